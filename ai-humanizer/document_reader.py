@@ -1,75 +1,94 @@
+import hashlib
 import io
+import math
+import multiprocessing
 import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Union
 import docx
-import pdfplumber
 import fitz  # PyMuPDF
 from PIL import Image
-from ocr import extract_text_from_pil_image
+from ocr import extract_text_with_confidence
+from ocr_cache import get_ocr_cache
+from header_parser import parse_pdf_page_header, parse_docx_header
+from image_store import get_image_store
 
-OCR_THRESHOLD = 50  # If extracted text has fewer chars than this, try OCR
+try:
+    import pdfplumber  # Optional: better line layout on table pages
+except ImportError:
+    pdfplumber = None
 
-def extract_images_from_pdf(file_bytes: bytes, output_dir: str) -> list[str]:
-    """
-    Extracts images from a PDF and saves them to output_dir.
-    Returns a list of saved filenames.
-    """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        
-    doc = fitz.open(stream=file_bytes, filetype="pdf")
-    image_paths = []
-    
-    for page_index in range(len(doc)):
-        page = doc[page_index]
-        image_list = page.get_images(full=True)
-        
-        for img_index, img in enumerate(image_list):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            ext = base_image["ext"]
-            
-            filename = f"pdf_image_p{page_index+1}_{img_index+1}.{ext}"
-            filepath = os.path.join(output_dir, filename)
-            
-            with open(filepath, "wb") as f:
-                f.write(image_bytes)
+OCR_THRESHOLD = 50  # If a page's extracted text has fewer chars than this, OCR that page
+# Share of the page area images must cover for a textless page to count as a scan
+OCR_MIN_IMAGE_COVERAGE = float(os.environ.get("OCR_MIN_IMAGE_COVERAGE", "0.6"))
+# Axis-aligned line segments a page needs before table detection is attempted at all
+TABLE_MIN_RULINGS = 4
+# Adaptive rasterization: start low, re-render higher only while Tesseract confidence is low
+OCR_DPI_STEPS = (150, 225, 300)
+OCR_MIN_CONFIDENCE = float(os.environ.get("OCR_MIN_CONFIDENCE", "75"))
+OCR_MAX_PIXELS = 12_000_000  # Caps the raster of oversized pages (~A3 at 300 DPI)
+OCR_CACHE_VERSION = "2"
+
+# Tesseract runs as a subprocess; this caps how many run at once per API process
+OCR_WORKERS = int(os.environ.get("OCR_WORKERS", "0")) or (os.cpu_count() or 1)
+OCR_PAGE_TIMEOUT = float(os.environ.get("OCR_PAGE_TIMEOUT", "60"))  # seconds per page, all DPI steps together
+
+# Page-parallel PDF extraction: documents with at least PARALLEL_MIN_PAGES pages
+# are split into page ranges across a process pool of PDF_WORKERS processes
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "0")) or (os.cpu_count() or 1)
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "24"))
+RANGES_PER_WORKER = 3  # Smaller ranges balance pages of uneven cost
+
+_pool = None
+_pool_lock = threading.Lock()
+_ocr_pool = None
+
+# Documents are passed around as a file path (spooled uploads) or raw bytes
+Source = Union[str, bytes]
+
+def _open_docx(source: Source):
+    return docx.Document(source if isinstance(source, str) else io.BytesIO(source))
+
+def _save_page_images(doc, page, store, seen_xrefs: set, image_paths: list[str]):
+    for img in page.get_images(full=True):
+        xref = img[0]
+        # Logos and repeated figures share one xref across pages
+        if xref in seen_xrefs:
+            continue
+        seen_xrefs.add(xref)
+        base_image = doc.extract_image(xref)
+        filename = store.put(base_image["image"], base_image["ext"])
+        if filename not in image_paths:
             image_paths.append(filename)
-            
-    return image_paths
 
-def extract_images_from_docx(file_bytes: bytes, output_dir: str) -> list[str]:
+def extract_images_from_docx(source: Source, output_dir: str) -> list[str]:
     """
-    Extracts images from a DOCX and saves them to output_dir.
+    Extracts images from a DOCX into the content-addressed store at output_dir.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        
-    doc = docx.Document(io.BytesIO(file_bytes))
+    store = get_image_store(output_dir)
+    doc = _open_docx(source)
     image_paths = []
-    img_count = 0
     
     for rel in doc.part.rels.values():
         if "image" in rel.target_ref:
-            img_count += 1
-            image_bytes = rel.target_part.blob
             # Guess extension from target_ref
             ext = rel.target_ref.split(".")[-1]
-            filename = f"docx_image_{img_count}.{ext}"
-            filepath = os.path.join(output_dir, filename)
-            
-            with open(filepath, "wb") as f:
-                f.write(image_bytes)
-            image_paths.append(filename)
+            filename = store.put(rel.target_part.blob, ext)
+            if filename not in image_paths:
+                image_paths.append(filename)
             
     return image_paths
 
-def read_docx(file_bytes: bytes) -> str:
+def read_docx(source: Source) -> str:
     """
     Extracts text from a DOCX file.
     """
     try:
-        doc = docx.Document(io.BytesIO(file_bytes))
+        doc = _open_docx(source)
         full_text = []
         for para in doc.paragraphs:
             if para.text.strip():
@@ -78,60 +97,342 @@ def read_docx(file_bytes: bytes) -> str:
     except Exception as e:
         raise ValueError(f"Error reading DOCX: {str(e)}")
 
-def read_pdf(file_bytes: bytes) -> tuple[str, str]:
+def _has_rulings(page) -> bool:
     """
-    Extracts text from a PDF file.
-    Returns (text, method) where method is 'text' or 'ocr'.
+    Cheap pre-check for find_tables: at least TABLE_MIN_RULINGS horizontal or
+    vertical line segments (rectangle edges included) among the page drawings.
+    Ruled-table detection works from these lines, so pages without them are skipped.
     """
-    text_content = []
-    
+    drawings = page.get_cdrawings() if hasattr(page, "get_cdrawings") else page.get_drawings()
+    count = 0
+    for path in drawings:
+        for item in path.get("items", ()):
+            if item[0] == "l":
+                (x0, y0), (x1, y1) = item[1], item[2]
+                if abs(x0 - x1) < 1 or abs(y0 - y1) < 1:
+                    count += 1
+            elif item[0] == "re":
+                count += 4
+            if count >= TABLE_MIN_RULINGS:
+                return True
+    return False
+
+def _is_layout_sensitive(page) -> bool:
+    """Pages with ruled tables, where pdfplumber keeps cell rows on one line."""
+    if not hasattr(page, "find_tables"):
+        return False
     try:
-        with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-            for page in pdf.pages:
-                page_text = page.extract_text()
-                
-                if page_text and len(page_text.strip()) > 0:
-                    text_content.append(page_text)
-        
-        extracted_text = "\n\n".join(text_content)
-        
-        if len(extracted_text.strip()) < OCR_THRESHOLD:
-            print("Low text density in PDF, switching to OCR...")
-            ocr_text_content = []
-            with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
-                for page in pdf.pages:
-                    im = page.to_image(resolution=300).original
-                    page_ocr_text = extract_text_from_pil_image(im)
-                    ocr_text_content.append(page_ocr_text)
-            
-            return "\n\n".join(ocr_text_content), "ocr"
+        # find_tables is ~50x the cost of get_text; only run it where table rulings exist
+        return _has_rulings(page) and bool(page.find_tables().tables)
+    except Exception:
+        return False
+
+def _image_coverage(page) -> float:
+    """Fraction of the page area covered by placed images (strips of a tiled scan add up)."""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height
+    if page_area <= 0:
+        return 0.0
+    covered = 0.0
+    for info in page.get_image_info():
+        bbox = fitz.Rect(info["bbox"]) & page_rect
+        if not bbox.is_empty:
+            covered += bbox.width * bbox.height
+    return min(covered / page_area, 1.0)
+
+def _rasterize(page, dpi: int) -> Image.Image:
+    # Grayscale is all Tesseract needs and a third of the memory of RGB
+    area_in = (page.rect.width / 72) * (page.rect.height / 72)
+    if area_in > 0:
+        dpi = min(dpi, int(math.sqrt(OCR_MAX_PIXELS / area_in)))
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+def _open_pdf(source: Source):
+    """By path, MuPDF reads pages from the file on demand instead of holding a copy."""
+    if isinstance(source, str):
+        return fitz.open(source)
+    return fitz.open(stream=source, filetype="pdf")
+
+def _get_ocr_pool() -> ThreadPoolExecutor:
+    global _ocr_pool
+    if _ocr_pool is None:
+        # Threads only wait on tesseract subprocesses, so the pool bounds the processes
+        _ocr_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="tesseract")
+    return _ocr_pool
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: the parent runs asyncio worker threads, which fork does not copy safely
+            _pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _reset_pool(broken: ProcessPoolExecutor):
+    """Drops a pool whose worker died; the next large PDF starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+def _scan_pages(doc, source, start: int, end: int, output_dir: str = None, with_header: bool = False) -> dict:
+    """
+    One PyMuPDF pass over pages [start, end) of an open document: page text,
+    embedded images (saved via the image store, by xref), OCR candidates and,
+    for the range holding page 0, the header. pdfplumber is only opened
+    (lazily, if installed) for table pages.
+    """
+    store = get_image_store(output_dir) if output_dir else None
+    plumber = None
+    pages_text = []
+    ocr_candidates = []
+    image_paths = []
+    seen_xrefs = set()
+    header = None
+
+    try:
+        for page_index in range(start, end):
+            page = doc[page_index]
+            page_text = page.get_text("text")
+
+            if pdfplumber is not None and page_text.strip() and _is_layout_sensitive(page):
+                try:
+                    if plumber is None:
+                        plumber = pdfplumber.open(source if isinstance(source, str) else io.BytesIO(source))
+                    page_text = plumber.pages[page_index].extract_text() or page_text
+                except Exception as e:
+                    print(f"pdfplumber fallback failed on page {page_index + 1}: {e}")
 
-        return extracted_text, "text"
+            pages_text.append(page_text.strip())
+            # Scanned pages: little or no text layer, and an image covering most of the page
+            # (a figure-only page with a short caption is not a scan)
+            if (len(page_text.strip()) < OCR_THRESHOLD and page.get_images()
+                    and _image_coverage(page) >= OCR_MIN_IMAGE_COVERAGE):
+                ocr_candidates.append(page_index)
 
+            if store is not None:
+                _save_page_images(doc, page, store, seen_xrefs, image_paths)
+
+            if with_header and page_index == 0:
+                try:
+                    header = parse_pdf_page_header(page, doc.metadata)
+                except Exception as e:
+                    print(f"Header parse error: {e}")
+    finally:
+        if plumber is not None:
+            plumber.close()
+
+    return {"pages": pages_text, "ocr_candidates": ocr_candidates, "images": image_paths, "header": header}
+
+def _page_fingerprint(doc, page) -> str:
+    """
+    Hash of the page geometry (rotation, MediaBox, CropBox), its content
+    stream and the raw bytes of every image it draws. The geometry changes
+    the rendered raster, so a rotated copy of a page is OCR'd on its own.
+    """
+    h = hashlib.sha256(f"ocr-v{OCR_CACHE_VERSION}".encode())
+    h.update(f"{page.rotation}|{tuple(page.mediabox)}|{tuple(page.cropbox)}".encode())
+    h.update(page.read_contents() or b"")
+    for img in page.get_images(full=True):
+        h.update(doc.xref_stream_raw(img[0]) or b"")
+    return h.hexdigest()
+
+def _ocr_page(doc, page_index: int, key: str, doc_lock: threading.Lock) -> str:
+    """
+    Adaptive OCR of one page: renders at each of OCR_DPI_STEPS until Tesseract
+    confidence reaches OCR_MIN_CONFIDENCE, keeping the best result.
+    All steps share one OCR_PAGE_TIMEOUT budget; a timeout or a Tesseract
+    error ends the escalation, since a larger raster would only fare worse.
+    PyMuPDF is not thread-safe, so rendering holds the document lock;
+    Tesseract runs outside it.
+    """
+    deadline = time.monotonic() + OCR_PAGE_TIMEOUT
+    best_text, best_conf, best_dpi = "", -1.0, 0
+    for dpi in OCR_DPI_STEPS:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        with doc_lock:
+            image = _rasterize(doc[page_index], dpi)
+        try:
+            text, conf = extract_text_with_confidence(image, remaining)
+        except TimeoutError:
+            print(f"OCR page {page_index + 1}: timed out at {dpi} DPI")
+            break
+        finally:
+            del image
+        if conf < 0:
+            break
+        if conf > best_conf:
+            best_text, best_conf, best_dpi = text, conf, dpi
+        if conf >= OCR_MIN_CONFIDENCE:
+            break
+    if best_conf >= 0:
+        get_ocr_cache().put(key, best_text, best_conf, best_dpi)
+        print(f"OCR page {page_index + 1}: {best_conf:.0f}% confidence at {best_dpi} DPI")
+    return best_text
+
+def _ocr_pages(doc, page_indexes: list[int]) -> dict[int, str]:
+    """
+    OCRs the given pages on the bounded Tesseract pool, each with a timeout.
+    Pages whose fingerprint is already in the OCR cache are not rendered at all.
+    """
+    cache = get_ocr_cache()
+    pool = _get_ocr_pool()
+    doc_lock = threading.Lock()
+    results = {}
+    futures = {}
+    for page_index in page_indexes:
+        with doc_lock:
+            key = _page_fingerprint(doc, doc[page_index])
+        cached = cache.get(key)
+        if cached is not None:
+            results[page_index] = cached[0]
+            continue
+        futures[pool.submit(_ocr_page, doc, page_index, key, doc_lock)] = page_index
+    if results:
+        print(f"OCR cache hit for {len(results)} of {len(page_indexes)} pages")
+    for future, page_index in futures.items():
+        results[page_index] = future.result()
+    return results
+
+def _scan_range_worker(path: str, start: int, end: int, output_dir: str, with_header: bool) -> dict:
+    doc = _open_pdf(path)
+    try:
+        return _scan_pages(doc, path, start, end, output_dir, with_header)
+    finally:
+        doc.close()
+
+def _split(items: list, parts: int) -> list[list]:
+    size = max(1, math.ceil(len(items) / parts))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def extract_pdf(source: Source, output_dir: str = None, with_header: bool = False) -> dict:
+    """
+    PDF text, embedded images, OCR candidates and optionally the first-page
+    header, with each page parsed once by PyMuPDF.
+    Large documents are split into page ranges across the process pool
+    (workers open the uploaded file, or a temp copy of in-memory bytes);
+    results are merged in page order. Pages without a text layer are
+    OCR'd individually.
+    Returns {"text", "method", "images", "header"}; method is "text",
+    "ocr" or "mixed".
+    """
+    doc = _open_pdf(source)
+    tmp_path = None
+    try:
+        page_count = len(doc)
+        parallel = PDF_WORKERS > 1 and page_count >= PARALLEL_MIN_PAGES
+        if parallel:
+            if isinstance(source, str):
+                path = source
+            else:
+                fd, tmp_path = tempfile.mkstemp(suffix=".pdf")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(source)
+                path = tmp_path
+            ranges = _split(list(range(page_count)), PDF_WORKERS * RANGES_PER_WORKER)
+            print(f"Extracting {page_count} PDF pages in {len(ranges)} ranges across {PDF_WORKERS} processes")
+            pool = _get_pool()
+            try:
+                futures = [
+                    pool.submit(_scan_range_worker, path, r[0], r[-1] + 1, output_dir, with_header and r[0] == 0)
+                    for r in ranges
+                ]
+                parts = [future.result() for future in futures]
+            except BrokenProcessPool as e:
+                # A worker crashed (MuPDF on a malformed file, OOM kill): replace the pool
+                # and scan this document in-process
+                print(f"PDF worker pool broke ({e}); scanning {page_count} pages in-process")
+                _reset_pool(pool)
+                parts = [_scan_pages(doc, source, 0, page_count, output_dir, with_header)]
+        else:
+            parts = [_scan_pages(doc, source, 0, page_count, output_dir, with_header)]
+
+        pages_text = [text for part in parts for text in part["pages"]]
+        ocr_candidates = [i for part in parts for i in part["ocr_candidates"]]
+        image_paths = list(dict.fromkeys(name for part in parts for name in part["images"]))
+        header = parts[0]["header"] if parts else None
+
+        # Selective OCR: only pages without a usable text layer
+        method = "text"
+        if ocr_candidates:
+            print(f"OCR on {len(ocr_candidates)} of {page_count} PDF pages...")
+            ocr_texts = _ocr_pages(doc, ocr_candidates)
+            for page_index, text in ocr_texts.items():
+                if text:
+                    pages_text[page_index] = text
+            native_pages = sum(1 for i, text in enumerate(pages_text) if text and i not in ocr_texts)
+            method = "mixed" if native_pages else "ocr"
+        extracted_text = "\n\n".join(t for t in pages_text if t)
+    finally:
+        doc.close()
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return {
+        "text": extracted_text,
+        "method": method,
+        "images": image_paths,
+        "header": header or {"title": "", "authors": [], "confidence": 0.0}
+    }
+
+def read_pdf(source: Source) -> tuple[str, str]:
+    """
+    Extracts text from a PDF file.
+    Returns (text, method) where method is 'text', 'ocr' or 'mixed'.
+    """
+    try:
+        result = extract_pdf(source)
+        return result["text"], result["method"]
     except Exception as e:
         raise ValueError(f"Error reading PDF: {str(e)}")
 
-def process_document(filename: str, file_bytes: bytes, extract_images: bool = False, output_image_dir: str = None) -> dict:
+def extract_document_text(filename: str, source: Source) -> tuple[str, str]:
     """
-    Main entry point for document processing.
-    Returns a dict with text, method, and optionally images.
+    Text-only extraction. Returns (text, method).
     """
     filename_lower = filename.lower()
-    result = {"text": "", "method": "", "images": []}
-    
     if filename_lower.endswith(".docx"):
-        result["text"] = read_docx(file_bytes)
-        result["method"] = "docx_text"
-        if extract_images and output_image_dir:
-            result["images"] = extract_images_from_docx(file_bytes, output_image_dir)
-            
+        return read_docx(source), "docx_text"
     elif filename_lower.endswith(".pdf"):
-        text, method = read_pdf(file_bytes)
-        result["text"] = text
-        result["method"] = method
-        if extract_images and output_image_dir:
-            result["images"] = extract_images_from_pdf(file_bytes, output_image_dir)
-    else:
-        raise ValueError("Unsupported file format. Please upload .pdf or .docx")
-        
-    return result
+        return read_pdf(source)
+    raise ValueError("Unsupported file format. Please upload .pdf or .docx")
+
+def extract_document(filename: str, source: Source, output_dir: str) -> dict:
+    """
+    Text, images and header in one go. PDFs are parsed in a single pass.
+    Returns {"text", "method", "images", "header"}.
+    """
+    filename_lower = filename.lower()
+    if filename_lower.endswith(".pdf"):
+        try:
+            return extract_pdf(source, output_dir, with_header=True)
+        except Exception as e:
+            raise ValueError(f"Error reading PDF: {str(e)}")
+    if filename_lower.endswith(".docx"):
+        try:
+            header = parse_docx_header(source)
+        except Exception as e:
+            print(f"Header parse error: {e}")
+            header = {"title": "", "authors": [], "confidence": 0.0}
+        return {
+            "text": read_docx(source),
+            "method": "docx_text",
+            "images": extract_images_from_docx(source, output_dir),
+            "header": header
+        }
+    raise ValueError("Unsupported file format. Please upload .pdf or .docx")
+
+def process_document(filename: str, source: Source, extract_images: bool = False, output_image_dir: str = None) -> dict:
+    """
+    Main entry point for document processing.
+    Returns a dict with text, method, and optionally images.
+    """
+    if extract_images and output_image_dir:
+        doc = extract_document(filename, source, output_image_dir)
+        return {"text": doc["text"], "method": doc["method"], "images": doc["images"]}
+    text, method = extract_document_text(filename, source)
+    return {"text": text, "method": method, "images": []}
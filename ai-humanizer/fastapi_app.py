@@ -1,7 +1,11 @@
 ﻿import sys
 import os
 import re
+import json
 import asyncio
+import hashlib
+import tempfile
+from contextlib import aclosing
 from dotenv import load_dotenv
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -11,9 +15,11 @@ sys.path.append(current_dir)
 # Load environment variables from root .env.local
 load_dotenv(os.path.join(parent_dir, ".env.local"))
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
+from typing import List, Optional
 from document_reader import process_document
 from services.ai_gateway import gateway
 from services.karion_service import KarionService
@@ -41,6 +47,58 @@ app.add_middleware(
 )
 
 
+# Uploads are streamed to temp files; anything past the cap is rejected with 413
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "100")) * 1024 * 1024)
+UPLOAD_CHUNK = 1024 * 1024
+UPLOAD_ROUTES = {"/extract-text", "/lexora/process"}
+
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    # Refuse on the declared size before any of the body is read
+    if request.method == "POST" and request.url.path in UPLOAD_ROUTES:
+        length = request.headers.get("content-length", "")
+        if length.isdigit() and int(length) > MAX_UPLOAD_BYTES:
+            return JSONResponse(status_code=413, content={
+                "detail": f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit"
+            })
+    return await call_next(request)
+
+
+async def spool_upload(file: UploadFile) -> tuple:
+    """
+    Streams an upload to a temp file in fixed-size chunks, hashing as it goes,
+    so no full in-memory copy is made. Returns (path, sha256); the caller
+    removes the file. Raises 413 once the size cap is passed.
+    """
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    fd, path = tempfile.mkstemp(prefix="upload-", suffix=suffix)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES // (1024 * 1024)} MB limit")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    finally:
+        await file.close()
+    return path, digest.hexdigest()
+
+
+@app.on_event("shutdown")
+async def close_clients():
+    await karion.aclose()
+
+
 @app.get("/")
 def health_check():
     return {"status": "ok", "service": "ALTRIX Research Intelligence Backend"}
@@ -50,7 +108,9 @@ def health_check():
 class KarionRequest(BaseModel):
     text: str
     style: str = "ieee"
+    styles: Optional[List[str]] = None  # extra styles rendered in the same pass
     mode: str = "standard"  # quick, standard, strict
+    race: bool = False  # run DOI / title / S2 lookups concurrently, first confident match wins
 
 
 @app.post("/karion/verify")
@@ -64,16 +124,24 @@ async def karion_verify(req: KarionRequest):
     """
     try:
         # Step 1: Extract
-        extracted = await karion.extract_metadata(req.text)
+        failed_chunks = []
+        extracted = await karion.extract_metadata(req.text, failed_chunks)
         if not extracted:
-            return {"formatted": [], "bibtex": "", "metadata": [], "warning": "No citations found or failed to parse."}
+            result = {"formatted": [], "bibtex": "", "metadata": [], "warning": "No citations found or failed to parse."}
+            if failed_chunks:
+                result["failed_chunks"] = failed_chunks
+            return result
 
-        # Step 2: Verify
-        verified_tasks = [karion.verify_metadata(item, mode=req.mode) for item in extracted]
-        verified_items = await asyncio.gather(*verified_tasks)
+        # Step 2: Verify (duplicates once, DOIs in batched Crossref queries, the rest one by one)
+        verified_items = await karion.verify_many(extracted, mode=req.mode, race=req.race)
 
         # Step 3 & 4: Format & Package
-        result = karion.format_citation(verified_items, style_name=req.style)
+        result = karion.format_citation(verified_items, style_name=req.style, styles=req.styles)
+        result["duplicates"] = karion.duplicate_groups(verified_items)
+        if failed_chunks:
+            # Reference text the extractor could not process, returned instead of silently dropped
+            result["failed_chunks"] = failed_chunks
+            result["warning"] = f"{len(failed_chunks)} reference chunk(s) could not be extracted."
         return result
     except Exception as e:
         import traceback
@@ -82,6 +150,31 @@ async def karion_verify(req: KarionRequest):
         raise HTTPException(status_code=500, detail=f"KARION Pipeline Error: {str(e)}")
 
 
+@app.post("/karion/verify/stream")
+async def karion_verify_stream(req: KarionRequest):
+    """
+    Streaming variant of /karion/verify (NDJSON, one JSON object per line):
+    - {"type": "reference", "index", "formatted", "metadata"} per citation,
+      sent as soon as that citation is extracted, verified and formatted
+    - {"type": "summary", "formatted", "bibtex", "metadata"} as the last frame
+    """
+    async def frames():
+        try:
+            # On client disconnect the whole generator chain is closed right away,
+            # releasing gateway scheduler slots held by in-flight streams
+            async with aclosing(karion.verify_stream(req.text, mode=req.mode, style_name=req.style,
+                                                     race=req.race)) as stream:
+                async for frame in stream:
+                    yield json.dumps(frame, default=str) + "\n"
+        except Exception as e:
+            import traceback
+            with open("backend_errors.log", "a") as f:
+                f.write(f"\n--- KARION Stream Error ---\n{traceback.format_exc()}\n")
+            yield json.dumps({"type": "error", "detail": f"KARION Pipeline Error: {str(e)}"}) + "\n"
+
+    return StreamingResponse(frames(), media_type="application/x-ndjson")
+
+
 # â”€â”€ Stage 3: Pragmatic Marker Injection â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 class MarkerRequest(BaseModel):
     text: str
@@ -124,9 +217,10 @@ async def extract_text(file: UploadFile = File(...)):
     if not any(file.filename.lower().endswith(ext) for ext in allowed):
         raise HTTPException(status_code=400, detail="Only PDF and DOCX supported")
 
+    path, _ = await spool_upload(file)
     try:
-        content = await file.read()
-        doc_data = process_document(file.filename, content)
+        # Parsing/OCR is CPU-bound; keep it off the event loop
+        doc_data = await asyncio.to_thread(process_document, file.filename, path)
         text = doc_data["text"]
         method = doc_data["method"]
 
@@ -157,6 +251,8 @@ async def extract_text(file: UploadFile = File(...)):
         with open("backend_errors.log", "a") as f:
             f.write(f"\n--- Error ---\n{traceback.format_exc()}\n")
         raise HTTPException(status_code=500, detail=f"Processing Error: {str(e)}")
+    finally:
+        os.remove(path)
 
 
 # â”€â”€ LEXORA: Academic Formatting â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -165,46 +261,42 @@ async def lexora_process(
     file: UploadFile = File(...),
     format: str = Form("IEEE"),
     autoDetect: str = Form("true"),
-    normalizeRefs: str = Form("true")
+    normalizeRefs: str = Form("true"),
+    refresh: str = Form("false")
 ):
     """
     LEXORA Pipeline:
-    1. Extract text from document.
-    2. Use AI to structure into LaTeX based on format.
+    1. Extract text and images from document (concurrently, off the event loop).
+    2. Use AI to structure into LaTeX based on format (metadata alongside body).
+    Response includes per-stage timings. Re-uploading the same file in another
+    format reuses the cached body ("cached": true) unless refresh=true.
     """
+    # Reject unsupported types before anything is written to disk
+    allowed = [".pdf", ".docx"]
+    if not any(file.filename.lower().endswith(ext) for ext in allowed):
+        raise HTTPException(status_code=400, detail="Only PDF and DOCX supported")
+
+    path, digest = await spool_upload(file)
     try:
-        # Step 1: Extract Text & Images
-        content = await file.read()
-        
         # Define image output directory in the public folder of the frontend
         img_dir = os.path.join(parent_dir, "public", "extracted_lexora")
         
-        doc_data = process_document(
-            file.filename, 
-            content, 
-            extract_images=True, 
-            output_image_dir=img_dir
-        )
-        
-        text = doc_data["text"]
-        
-        # Step 2: Format LaTeX
         options = {
             "autoDetect": autoDetect.lower() == "true",
-            "normalizeRefs": normalizeRefs.lower() == "true",
-            "images": doc_data["images"]
+            "normalizeRefs": normalizeRefs.lower() == "true"
         }
-        result = await lexora.process_text(text, format, options)
-        
-        # Add image info to result
-        result["extracted_images"] = doc_data["images"]
-        
-        return result
+        # Text/image extraction, metadata and body generation run as a stage graph
+        return await lexora.process_document(
+            file.filename, path, format, options, img_dir,
+            refresh=refresh.lower() == "true", digest=digest
+        )
     except Exception as e:
         import traceback
         with open("backend_errors.log", "a") as f:
             f.write(f"\n--- LEXORA Error ---\n{traceback.format_exc()}\n")
         raise HTTPException(status_code=500, detail=f"LEXORA Pipeline Error: {str(e)}")
+    finally:
+        os.remove(path)
 
 
 if __name__ == "__main__":
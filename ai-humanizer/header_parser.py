@@ -0,0 +1,170 @@
+import io
+import re
+import statistics
+import docx
+
+# Lines that end the header block
+HEADER_STOP_RE = re.compile(r"^\s*(?:abstract|keywords|index terms|introduction|\d+\.?\s+introduction|i\.\s+introduction)\b", re.IGNORECASE)
+# Affiliation / contact lines between the title and the abstract
+AFFILIATION_RE = re.compile(
+    r"@|https?://|\b(?:universit|institut|department|dept\.|school|college|laborator|faculty|"
+    r"centre|center|corporation|inc\.|ltd|research|labs?\b|google|microsoft|meta\b|email|e-mail)", re.IGNORECASE
+)
+AUTHOR_SPLIT_RE = re.compile(r",\s*(?:and|&)\s+|\s+(?:and|&)\s+|[,;·•]\s*")
+# Footnote markers glued to names: "Ashish Vaswani1,2*", "Noam Shazeer†"
+AUTHOR_MARK_RE = re.compile(r"[\d∗*†‡§¶#]+|\(\w\)")
+# APA page header, never the title: "Running head: SHORT TITLE"
+RUNNING_HEAD_RE = re.compile(r"^\s*running\s+head\b", re.IGNORECASE)
+# Words and endings of title-case titles that do not occur in personal names
+TITLE_WORDS = frozenset(
+    "neural machine network networks learning model models system systems data language languages vision "
+    "graph graphs image images deep analysis survey towards toward robust efficient large scale transformer "
+    "transformers attention training detection recognition generation retrieval optimization".split()
+)
+TITLE_SUFFIX_RE = re.compile(r"(?:tion|sion|ment|ness|ity|ics|ogy|ism|ical|ous)$")
+NAME_TOKEN_RE = re.compile(r"^(?:[A-Z][a-zA-Z'\-]+|[A-Z]\.(?:-?[A-Z]\.)*|(?:van|von|de|der|da|di|del|la|le)|[A-Z][a-z]+-[A-Z][a-z]+)$")
+
+# Confidence at or above which the LLM fallback is skipped
+HEADER_CONFIDENCE_THRESHOLD = 0.7
+
+
+def _clean(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def looks_like_name(text: str) -> bool:
+    tokens = text.split()
+    if not (2 <= len(tokens) <= 5 and all(NAME_TOKEN_RE.match(t) for t in tokens)):
+        return False
+    # "Neural Machine Translation" has the shape of a name, but not the words
+    words = [t.lower() for t in tokens if len(t) > 3]
+    return not any(w in TITLE_WORDS or TITLE_SUFFIX_RE.search(w) for w in words)
+
+
+def split_authors(lines: list[str]) -> list[str]:
+    """
+    Author names from the header lines that follow the title.
+    Affiliation lines are skipped; names are split on commas / "and".
+    """
+    authors = []
+    for line in lines:
+        if AFFILIATION_RE.search(line):
+            continue
+        line = AUTHOR_MARK_RE.sub("", line)
+        for part in AUTHOR_SPLIT_RE.split(line):
+            part = _clean(part)
+            if looks_like_name(part) and part not in authors:
+                authors.append(part)
+    return authors
+
+
+def _score(title: str, authors: list[str], title_signal: float) -> float:
+    """
+    title_signal: how clearly the layout singled out the title (0..1),
+    e.g. font-size ratio for PDFs or an explicit Title style for DOCX.
+    Without layout evidence the score stays below HEADER_CONFIDENCE_THRESHOLD
+    (at most 0.5), so a plausible-looking guess alone never skips the LLM;
+    reaching the threshold takes a title_signal of about 0.6.
+    """
+    score = 0.0
+    if 3 <= len(title.split()) <= 30 and not title.isdigit():
+        score += 0.15 + 0.35 * title_signal
+    if authors:
+        score += 0.25
+        if len(authors) <= 20:
+            score += 0.1
+    return round(score, 2)
+
+
+def parse_pdf_page_header(page, metadata: dict = None) -> dict:
+    """
+    Title and authors from an already opened PyMuPDF first page, using span
+    font sizes: the title is the largest text in the upper half of the page, authors
+    are the name-like lines between it and the abstract.
+    Returns {"title", "authors", "confidence"}.
+    """
+    page_height = page.rect.height
+    lines = []
+    for block in page.get_text("dict").get("blocks", []):
+        for line in block.get("lines", []):
+            spans = [s for s in line.get("spans", []) if s.get("text", "").strip()]
+            if not spans:
+                continue
+            text = _clean(" ".join(s["text"] for s in spans))
+            if RUNNING_HEAD_RE.match(text):
+                continue
+            size = max(s["size"] for s in spans)
+            lines.append({"text": text, "size": round(size, 1), "y": line["bbox"][1]})
+    meta_title = _clean((metadata or {}).get("title") or "")
+
+    if not lines:
+        return {"title": "", "authors": [], "confidence": 0.0}
+    lines.sort(key=lambda l: l["y"])
+    body_size = statistics.median(l["size"] for l in lines)
+
+    # Header block: everything above the abstract / introduction
+    header = []
+    for line in lines:
+        if HEADER_STOP_RE.match(line["text"]):
+            break
+        header.append(line)
+    upper = [l for l in header if l["y"] < page_height / 2] or header or lines[:10]
+
+    title_size = max(l["size"] for l in upper)
+    title_idx = [i for i, l in enumerate(header) if l["size"] == title_size]
+    if title_idx:
+        # Consecutive lines at the title size make up a wrapped title
+        start = end = title_idx[0]
+        while end + 1 < len(header) and header[end + 1]["size"] == title_size:
+            end += 1
+        title = _clean(" ".join(l["text"] for l in header[start:end + 1]))
+        rest = [l for l in header[end + 1:] if l["size"] < title_size]
+        # Names share one font size, affiliations are usually set smaller
+        name_size = next((l["size"] for l in rest if split_authors([l["text"]])), None)
+        author_lines = [l["text"] for l in rest if l["size"] == name_size]
+    else:
+        title, author_lines = "", []
+
+    # The document info title is a cheap tie-breaker when it agrees with the layout
+    if meta_title and len(meta_title.split()) >= 3 and meta_title.lower() in title.lower():
+        title_signal = 1.0
+    else:
+        title_signal = min(max((title_size / body_size - 1.0) / 0.5, 0.0), 1.0) if body_size else 0.0
+
+    authors = split_authors(author_lines)
+    return {"title": title, "authors": authors, "confidence": _score(title, authors, title_signal)}
+
+
+def parse_docx_header(source) -> dict:
+    """
+    Title from the first paragraph styled "Title" (or the core properties),
+    authors from the paragraphs between it and the abstract.
+    Returns {"title", "authors", "confidence"}.
+    """
+    doc = docx.Document(source if isinstance(source, str) else io.BytesIO(source))
+    paragraphs = [(p.style.name if p.style is not None else "", _clean(p.text)) for p in doc.paragraphs]
+    paragraphs = [(style, text) for style, text in paragraphs if text and not RUNNING_HEAD_RE.match(text)]
+
+    title, title_signal, start = "", 0.0, 0
+    for i, (style, text) in enumerate(paragraphs[:15]):
+        if style.lower() == "title":
+            title, title_signal, start = text, 1.0, i + 1
+            break
+    if not title:
+        core_title = _clean(doc.core_properties.title or "")
+        if core_title:
+            title, title_signal = core_title, 0.5
+            start = next((i + 1 for i, (_, text) in enumerate(paragraphs[:15]) if text == core_title), 0)
+        elif paragraphs:
+            # Unstyled document: first paragraph, low confidence
+            title, start = paragraphs[0][1], 1
+
+    author_lines = []
+    for style, text in paragraphs[start:start + 10]:
+        if HEADER_STOP_RE.match(text) or style.lower().startswith("heading"):
+            break
+        author_lines.append(text)
+
+    authors = split_authors(author_lines)
+    return {"title": title, "authors": authors, "confidence": _score(title, authors, title_signal)}
+
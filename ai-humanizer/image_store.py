@@ -0,0 +1,120 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+# Size cap of each store directory before least-recently-used images are removed
+DEFAULT_MAX_MB = float(os.environ.get("LEXORA_IMAGE_STORE_MB", "512"))
+
+
+class ImageStore:
+    """
+    Content-addressed image directory.
+    Files are named by the SHA-256 of their bytes, so identical figures are
+    written once and concurrent uploads never overwrite each other's images.
+    Writes go to a temp file in the same directory and are moved into place
+    atomically. When the directory grows past max_bytes the least recently
+    used files (by mtime, refreshed on every reuse) are deleted.
+    """
+
+    def __init__(self, root: str, max_bytes: int = None):
+        self.root = root
+        self.max_bytes = max_bytes or int(DEFAULT_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(root, exist_ok=True)
+
+    def put(self, data: bytes, ext: str) -> str:
+        """Stores `data` and returns its filename relative to the store root."""
+        ext = (ext or "bin").lower().lstrip(".")
+        filename = f"{hashlib.sha256(data).hexdigest()[:32]}.{ext}"
+        path = os.path.join(self.root, filename)
+
+        if os.path.exists(path):
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+            return filename
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".tmp-", suffix=f".{ext}")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = self._disk_usage()
+            else:
+                self._size += len(data)
+            over = self._size > self.max_bytes
+        if over:
+            self.gc()
+        return filename
+
+    def touch(self, filenames) -> bool:
+        """
+        Marks stored images as just used, so gc keeps them. Returns False if
+        any of them is already gone.
+        """
+        present = True
+        for filename in filenames:
+            try:
+                os.utime(os.path.join(self.root, filename))
+            except FileNotFoundError:
+                present = False
+            except OSError:
+                pass
+        return present
+
+    def _files(self):
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.startswith(".tmp-"):
+                    yield entry
+
+    def _disk_usage(self) -> int:
+        return sum(entry.stat().st_size for entry in self._files())
+
+    def gc(self):
+        """Deletes least recently used images until the store is below 90% of max_bytes."""
+        with self._lock:
+            files = sorted(
+                ((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in self._files()),
+                key=lambda f: f[0]
+            )
+            size = sum(f[1] for f in files)
+            target = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, file_size, path in files:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                    size -= file_size
+                    removed += 1
+                except FileNotFoundError:
+                    size -= file_size
+                except OSError:
+                    continue
+            self._size = size
+        if removed:
+            print(f"ImageStore: Removed {removed} images from {self.root}")
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_image_store(root: str) -> ImageStore:
+    """Shared ImageStore per directory, so size accounting survives across uploads."""
+    root = os.path.abspath(root)
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ImageStore(root)
+        return _stores[root]
@@ -14,13 +14,43 @@ def extract_text_from_image(image_bytes: bytes) -> str:
         print(f"OCR Error: {e}")
         return ""
 
-def extract_text_from_pil_image(image: Image.Image) -> str:
+def extract_text_with_confidence(image: Image.Image, timeout: float = 0) -> tuple[str, float]:
     """
-    Extracts text from a PIL Image object.
+    Extracts text from a PIL Image object in a single Tesseract run and
+    reports the mean word confidence (0-100). Returns ("", -1.0) on error.
+    A non-zero timeout (seconds) kills Tesseract if it runs longer and
+    raises TimeoutError.
     """
     try:
-        text = pytesseract.image_to_string(image)
-        return text.strip()
+        data = pytesseract.image_to_data(image, timeout=timeout, output_type=pytesseract.Output.DICT)
+    except RuntimeError as e:
+        # pytesseract reports a killed process as RuntimeError("Tesseract process timeout")
+        if "timeout" in str(e).lower():
+            raise TimeoutError(f"Tesseract exceeded {timeout}s") from e
+        print(f"OCR Error: {e}")
+        return "", -1.0
     except Exception as e:
         print(f"OCR Error: {e}")
-        return ""
+        return "", -1.0
+
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data.get("text", [])):
+        word = (word or "").strip()
+        conf = float(data["conf"][i])
+        if not word or conf < 0:
+            continue
+        confidences.append(conf)
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+
+    text_lines = []
+    previous = None
+    for key in sorted(lines):
+        # Blank line between paragraphs, like image_to_string
+        if previous is not None and key[:2] != previous[:2]:
+            text_lines.append("")
+        text_lines.append(" ".join(lines[key]))
+        previous = key
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return "\n".join(text_lines).strip(), round(confidence, 1)
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional, Tuple
+
+
+class OcrCache:
+    """
+    Persistent SQLite cache of per-page OCR results.
+    Keys are content fingerprints of the page (content stream, geometry and
+    the raw bytes of its images), so re-uploads of the same scan skip
+    rendering and Tesseract entirely.
+    Entries older than `max_age` are purged, and beyond `max_entries` the
+    oldest go first; purging runs on first use and then at most every
+    `purge_interval`.
+    """
+
+    def __init__(self, path: Optional[str] = None,
+                 max_age: Optional[float] = None,
+                 max_entries: Optional[int] = None,
+                 purge_interval: float = 3600):
+        default_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "ocr_cache.sqlite3")
+        self.path = path or os.environ.get("OCR_CACHE_PATH") or default_path
+        self.max_age = max_age or float(os.environ.get("OCR_CACHE_MAX_DAYS", "90")) * 24 * 3600
+        self.max_entries = max_entries or int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "20000"))
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS ocr_pages ("
+                "key TEXT PRIMARY KEY, text TEXT NOT NULL, confidence REAL NOT NULL, "
+                "dpi INTEGER NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ocr_pages_created ON ocr_pages(created_at)")
+            self._conn = conn
+            self._purge(conn)
+        return self._conn
+
+    def _purge(self, conn: sqlite3.Connection):
+        """Deletes expired rows, then the oldest ones above max_entries. Caller holds the lock."""
+        now = time.time()
+        with conn:
+            deleted = conn.execute("DELETE FROM ocr_pages WHERE created_at <= ?", (now - self.max_age,)).rowcount
+            deleted += conn.execute(
+                "DELETE FROM ocr_pages WHERE key IN ("
+                "SELECT key FROM ocr_pages ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+        self._last_purge = now
+        if deleted:
+            print(f"OCR Cache: Purged {deleted} entries")
+
+    def get(self, key: str) -> Optional[Tuple[str, float]]:
+        """(text, confidence) for a page fingerprint, or None on a miss."""
+        try:
+            with self._lock:
+                row = self._connect().execute(
+                    "SELECT text, confidence FROM ocr_pages WHERE key = ?", (key,)
+                ).fetchone()
+            return (row[0], row[1]) if row else None
+        except Exception as e:
+            print(f"OCR Cache read error: {e}")
+            return None
+
+    def put(self, key: str, text: str, confidence: float, dpi: int):
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO ocr_pages (key, text, confidence, dpi, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (key, text, confidence, dpi, time.time())
+                    )
+                if time.time() - self._last_purge >= self.purge_interval:
+                    self._purge(conn)
+        except Exception as e:
+            print(f"OCR Cache write error: {e}")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache() -> OcrCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = OcrCache()
+        return _cache
@@ -3,8 +3,11 @@ import httpx
 import json
 import os
 import time
-from typing import Dict, Any, Optional, List
+from collections import deque
+from typing import Dict, Any, Optional, List, AsyncIterator
 from dotenv import load_dotenv
+from services.scheduler import FairScheduler, QueueTimeout
+from services.batcher import LightBatcher
 
 class AIGateway:
     def __init__(self):
@@ -13,6 +16,28 @@ class AIGateway:
         self._load_key()
         self.base_url = "https://api.groq.com/openai/v1/chat/completions"
 
+        # Hedging (tail-latency control)
+        # A hedge fires once a call outlives the given latency percentile of recent
+        # successful calls. Every hedge-eligible request earns `hedge_budget` tokens,
+        # each hedge spends one, so extra load stays at ~10% of hedged traffic.
+        self.hedge_percentile = 0.95
+        self.hedge_min_samples = 20
+        self.hedge_default_delay = {"heavy": 8.0, "light": 3.0}
+        self.hedge_min_delay = 0.5
+        self.hedge_budget = 0.1
+        self.hedge_burst = 3.0
+        self._hedge_tokens = self.hedge_burst
+        self._latencies = {"heavy": deque(maxlen=200), "light": deque(maxlen=200)}
+
+        # Micro-batching of small light-model prompts (opt-in per call via `batchable`)
+        self.batching = True
+        self.batcher = LightBatcher(self)
+
+        # Continuation of length-truncated completions (opt-in per call via `continue_on_length`)
+        # The partial output's tail is sent back as an assistant turn and the pieces are stitched.
+        self.continuation_max_rounds = 3
+        self.continuation_tail_chars = 8000
+
     def _load_key(self):
         # Look for .env.local in current dir or parent (root)
         # Structure: root/ai-humanizer/services/ai_gateway.py
@@ -30,9 +55,9 @@ class AIGateway:
             print(f"Gateway: Fallback API Key loaded (starts with {self.api_key_2[:5]}...)")
         self.base_url = "https://api.groq.com/openai/v1/chat/completions"
         
-        # Concurrency Semaphores
-        self.sem_heavy = asyncio.Semaphore(2)  # Max 2 concurrent 70B requests
-        self.sem_light = asyncio.Semaphore(4)  # Max 4 concurrent 8B requests
+        # Concurrency limits with weighted fair queueing across priority classes
+        self.sched_heavy = FairScheduler(2)  # Max 2 concurrent 70B requests
+        self.sched_light = FairScheduler(4)  # Max 4 concurrent 8B requests
         
         # Model Mapping
         self.models = {
@@ -46,13 +71,29 @@ class AIGateway:
                        system_prompt: str = "You are a helpful assistant.",
                        temperature: float = 0.1,
                        max_tokens: int = 1024,
-                       response_format: Optional[Dict] = None) -> Dict[str, Any]:
+                       response_format: Optional[Dict] = None,
+                       hedge: bool = False,
+                       priority: str = "standard",
+                       tenant: Optional[str] = None,
+                       queue_timeout: Optional[float] = None,
+                       batchable: bool = False,
+                       continue_on_length: bool = False,
+                       max_continuations: Optional[int] = None) -> Dict[str, Any]:
         """
         Centrally handles Groq API calls with:
         - Model routing
-        - Concurrency control
+        - Concurrency control (priority classes: interactive, standard, bulk;
+          round-robin between tenants; fails fast past the queue deadline)
         - Retries & Timeouts
         - Token truncation
+        - Optional hedging: if the call runs past the latency percentile, a second
+          attempt is started on the other key (or the light model) and the first
+          successful response wins.
+        - Optional micro-batching: small `batchable` light-model prompts that
+          arrive within a short window share a single upstream call.
+        - Optional continuation: when `continue_on_length` is set and the model stops
+          on max_tokens, the rest is requested (up to `max_continuations` rounds) and
+          stitched into one response; `result["continuations"]` counts the rounds.
         """
         
         if not self.api_key:
@@ -61,19 +102,167 @@ class AIGateway:
         if not self.api_key:
             return {"error": "GROQ_API_KEY not configured", "status_code": 500}
         
-        # Try primary key first, fall back to key_2 on rate-limit or auth error
-        keys_to_try = [k for k in [self.api_key, self.api_key_2] if k]
+        keys_to_try = self._keys()
+
+        queue = {"priority": priority, "tenant": tenant, "queue_timeout": queue_timeout}
+        if batchable and self.batching and model_type == "light" and not response_format and not hedge:
+            return await self.batcher.submit(system_prompt, prompt, temperature, max_tokens, queue)
+        if hedge:
+            res = await self._hedged_call(model_type, keys_to_try, prompt, system_prompt,
+                                          temperature, max_tokens, response_format, queue)
+        else:
+            res = await self._call(model_type, keys_to_try, prompt, system_prompt,
+                                   temperature, max_tokens, response_format, queue)
+
+        # JSON mode cannot resume mid-document, so structured responses are returned as-is
+        if continue_on_length and not response_format and "error" not in res:
+            rounds = self.continuation_max_rounds if max_continuations is None else max_continuations
+            res = await self._continue(model_type, keys_to_try, prompt, system_prompt, temperature,
+                                       max_tokens, queue, hedge, res, rounds)
+        return res
+
+    async def generate_stream(self,
+                              model_type: str,
+                              prompt: str,
+                              system_prompt: str = "You are a helpful assistant.",
+                              temperature: float = 0.1,
+                              max_tokens: int = 1024,
+                              priority: str = "standard",
+                              tenant: Optional[str] = None,
+                              queue_timeout: Optional[float] = None,
+                              status: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+        """
+        Streaming variant of generate(): yields content deltas as they arrive.
+        Keys are only switched before the first token; once output has started,
+        an upstream failure simply ends the stream.
+        If given, `status["finish_reason"]` is set when the stream ends: the
+        upstream value ("stop", "length", ...) or "error" when it broke off.
+        """
+        if status is None:
+            status = {}
+        status["finish_reason"] = "error"
+        if not self.api_key:
+            self._load_key()
+
+        if not self.api_key:
+            print("Gateway: GROQ_API_KEY not configured")
+            return
 
+        keys_to_try = self._keys()
         model = self.models.get(model_type, self.models["light"])
-        semaphore = self.sem_heavy if model_type == "heavy" else self.sem_light
-        
+        scheduler = self.sched_heavy if model_type == "heavy" else self.sched_light
+        prompt = self._truncate(model_type, prompt)
+
+        try:
+            await scheduler.acquire(priority, tenant, queue_timeout)
+        except QueueTimeout as e:
+            print(f"Gateway: {e}")
+            return
+
+        try:
+            payload = {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": temperature,
+                "max_tokens": max_tokens,
+                "stream": True
+            }
+            for key_index, active_key in enumerate(keys_to_try):
+                key_label = "primary" if key_index == 0 else "fallback"
+                emitted = False
+                try:
+                    async with httpx.AsyncClient(timeout=25.0) as client:
+                        async with client.stream(
+                            "POST",
+                            self.base_url,
+                            headers={"Authorization": f"Bearer {active_key}"},
+                            json=payload
+                        ) as response:
+                            if response.status_code != 200:
+                                await response.aread()
+                                print(f"Gateway: Stream on {key_label} key got {response.status_code}. Trying next key...")
+                                continue
+
+                            async for line in response.aiter_lines():
+                                if not line.startswith("data:"):
+                                    continue
+                                data = line[5:].strip()
+                                if data == "[DONE]":
+                                    # A complete stream that did not report why it ended
+                                    if status["finish_reason"] == "error":
+                                        status["finish_reason"] = "stop"
+                                    break
+                                try:
+                                    chunk = json.loads(data)
+                                except json.JSONDecodeError:
+                                    continue
+                                choice = (chunk.get("choices") or [{}])[0]
+                                if choice.get("finish_reason"):
+                                    status["finish_reason"] = choice["finish_reason"]
+                                delta = choice.get("delta", {}).get("content")
+                                if delta:
+                                    emitted = True
+                                    yield delta
+                            # Whole-stream durations are not recorded: hedge delays are
+                            # percentiles of complete non-streamed calls only
+                            return
+                except httpx.TimeoutException:
+                    print(f"Gateway: Stream timeout ({key_label} key).")
+                    if emitted:
+                        return
+                except Exception as e:
+                    print(f"Gateway Critical Error (stream): {str(e)}")
+                    return
+            print("Gateway: Stream failed across all keys")
+        finally:
+            scheduler.release()
+
+    def _keys(self) -> List[str]:
+        # Try primary key first, fall back to key_2 on rate-limit or auth error
+        return [k for k in [self.api_key, self.api_key_2] if k]
+
+    def _truncate(self, model_type: str, prompt: str) -> str:
         # Safety Truncation (Approx 6k tokens for 70B, 4k for 8B)
         max_input = 24000 if model_type == "heavy" else 16000 # Rough char count limit
         if len(prompt) > max_input:
             print(f"Gateway: Truncating large input for {model_type} request.")
             prompt = prompt[:max_input] + "\n[TRUNCATED]"
+        return prompt
+
+    async def _call(self,
+                    model_type: str,
+                    keys_to_try: List[str],
+                    prompt: str,
+                    system_prompt: str,
+                    temperature: float,
+                    max_tokens: int,
+                    response_format: Optional[Dict],
+                    queue: Dict[str, Any],
+                    started: Optional[asyncio.Event] = None,
+                    extra_messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        """
+        Single logical request: scheduler slot, key fallback and retries.
+        `started` is set once a concurrency slot is held, so hedge timers
+        measure upstream latency rather than queueing time.
+        `extra_messages` are appended after the user prompt (continuation turns).
+        """
+        model = self.models.get(model_type, self.models["light"])
+        scheduler = self.sched_heavy if model_type == "heavy" else self.sched_light
+        prompt = self._truncate(model_type, prompt)
 
-        async with semaphore:
+        try:
+            await scheduler.acquire(queue["priority"], queue["tenant"], queue["queue_timeout"])
+        except QueueTimeout as e:
+            print(f"Gateway: {e}")
+            return {"error": f"Gateway queue deadline exceeded: {e}", "status_code": 503}
+
+        try:
+            if started:
+                started.set()
+            t0 = time.monotonic()
             for key_index, active_key in enumerate(keys_to_try):
                 key_label = "primary" if key_index == 0 else "fallback"
                 retries = 2
@@ -87,7 +276,7 @@ class AIGateway:
                                 "messages": [
                                     {"role": "system", "content": system_prompt},
                                     {"role": "user", "content": prompt}
-                                ],
+                                ] + (extra_messages or []),
                                 "temperature": temperature,
                                 "max_tokens": max_tokens
                             }
@@ -101,13 +290,16 @@ class AIGateway:
                             )
 
                             if response.status_code == 200:
+                                self._record_latency(model_type, time.monotonic() - t0)
                                 return response.json()
 
                             # Rate limit or auth error → try next key
                             if response.status_code in [429, 401]:
                                 if response.status_code == 429 and model_type == "heavy" and key_index == len(keys_to_try) - 1:
                                     print("Gateway: All keys rate limited on heavy model. Falling back to light model...")
-                                    return await self.generate("light", prompt, system_prompt, temperature, max_tokens, response_format)
+                                    return await self._call("light", keys_to_try, prompt, system_prompt, temperature,
+                                                            max_tokens, response_format, queue,
+                                                            extra_messages=extra_messages)
                                 print(f"Gateway: {key_label} key got {response.status_code}. Trying next key...")
                                 break  # break inner retry loop → go to next key
 
@@ -128,6 +320,160 @@ class AIGateway:
                         return {"error": f"Gateway Critical Error: {str(e)}", "status_code": 500}
 
             return {"error": "Exceeded maximum retries or timeout across all keys", "status_code": 504}
+        finally:
+            scheduler.release()
+
+    def _record_latency(self, model_type: str, elapsed: float):
+        samples = self._latencies.get(model_type)
+        if samples is not None:
+            samples.append(elapsed)
+
+    def _hedge_delay(self, model_type: str) -> float:
+        """Latency percentile of recent successful calls, or a static default while warming up."""
+        samples = self._latencies.get(model_type, [])
+        if len(samples) < self.hedge_min_samples:
+            return self.hedge_default_delay.get(model_type, 3.0)
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(self.hedge_percentile * len(ordered)))
+        return max(self.hedge_min_delay, ordered[idx])
+
+    async def _hedged_call(self,
+                           model_type: str,
+                           keys_to_try: List[str],
+                           prompt: str,
+                           system_prompt: str,
+                           temperature: float,
+                           max_tokens: int,
+                           response_format: Optional[Dict],
+                           queue: Dict[str, Any],
+                           extra_messages: Optional[List[Dict[str, str]]] = None) -> Dict[str, Any]:
+        if len(keys_to_try) < 2 and model_type == "light":
+            # Neither another key nor another model to hedge on: a second attempt would be
+            # the identical request on the same key, doubling its rate-limit use
+            return await self._call(model_type, keys_to_try, prompt, system_prompt, temperature,
+                                    max_tokens, response_format, queue, extra_messages=extra_messages)
+        self._hedge_tokens = min(self.hedge_burst, self._hedge_tokens + self.hedge_budget)
+
+        started = asyncio.Event()
+        primary = asyncio.create_task(self._call(model_type, keys_to_try, prompt, system_prompt,
+                                                 temperature, max_tokens, response_format, queue, started,
+                                                 extra_messages))
+        # Start the hedge clock only once the primary holds a slot
+        waiter = asyncio.create_task(started.wait())
+        tasks = [primary, waiter]
+        try:
+            await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+            waiter.cancel()
+
+            delay = self._hedge_delay(model_type)
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            if self._hedge_tokens < 1.0:
+                return await primary
+            self._hedge_tokens -= 1.0
+
+            # Second attempt: other key first if we have one, otherwise the light model
+            if len(keys_to_try) > 1:
+                hedge_type, hedge_keys = model_type, keys_to_try[1:] + keys_to_try[:1]
+            else:
+                hedge_type, hedge_keys = "light", keys_to_try
+            print(f"Gateway: {model_type} call exceeded {delay:.1f}s. Hedging on {hedge_type} model...")
+            secondary = asyncio.create_task(self._call(hedge_type, hedge_keys, prompt, system_prompt,
+                                                       temperature, max_tokens, response_format, queue,
+                                                       extra_messages=extra_messages))
+            tasks.append(secondary)
+
+            pending = {primary, secondary}
+            result = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    res = task.result()
+                    if "error" not in res:
+                        return res
+                    # Keep the first error in case both attempts fail
+                    result = result or res
+            return result
+        finally:
+            # Also runs when the caller is cancelled: no attempt may keep its scheduler slot
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _continue(self,
+                        model_type: str,
+                        keys_to_try: List[str],
+                        prompt: str,
+                        system_prompt: str,
+                        temperature: float,
+                        max_tokens: int,
+                        queue: Dict[str, Any],
+                        hedge: bool,
+                        res: Dict[str, Any],
+                        max_rounds: int) -> Dict[str, Any]:
+        """
+        Resumes a completion that stopped on max_tokens. Each round sends the
+        tail of the output so far as an assistant turn plus a "continue" user
+        turn; pieces are stitched with overlap removal. Stops on a natural
+        finish, an error, an empty piece or after `max_rounds` rounds.
+        """
+        choice = (res.get("choices") or [{}])[0]
+        content = (choice.get("message") or {}).get("content") or ""
+        finish_reason = choice.get("finish_reason")
+        usage = dict(res.get("usage") or {})
+        rounds = 0
+
+        while finish_reason == "length" and rounds < max_rounds:
+            rounds += 1
+            print(f"Gateway: {model_type} output hit max_tokens ({len(content)} chars). Continuation round {rounds}/{max_rounds}...")
+            extra_messages = [
+                {"role": "assistant", "content": content[-self.continuation_tail_chars:]},
+                {"role": "user", "content": (
+                    "Your previous answer was cut off. Continue EXACTLY where it stopped, "
+                    "mid-sentence if necessary. Do not repeat earlier text, do not restart, "
+                    "and add no commentary or code fences."
+                )}
+            ]
+            if hedge:
+                nxt = await self._hedged_call(model_type, keys_to_try, prompt, system_prompt, temperature,
+                                              max_tokens, None, queue, extra_messages)
+            else:
+                nxt = await self._call(model_type, keys_to_try, prompt, system_prompt, temperature,
+                                       max_tokens, None, queue, extra_messages=extra_messages)
+            if "error" in nxt:
+                print(f"Gateway: Continuation round {rounds} failed: {nxt['error']}")
+                break
+            next_choice = (nxt.get("choices") or [{}])[0]
+            piece = (next_choice.get("message") or {}).get("content") or ""
+            finish_reason = next_choice.get("finish_reason")
+            for k, v in (nxt.get("usage") or {}).items():
+                if isinstance(v, (int, float)):
+                    usage[k] = usage.get(k, 0) + v
+            if not piece.strip():
+                break
+            content = self._stitch_continuation(content, piece)
+
+        if rounds == 0:
+            res["continuations"] = 0
+            return res
+        merged = dict(res)
+        merged["choices"] = [dict(choice, message=dict(choice.get("message") or {}, content=content),
+                                  finish_reason=finish_reason)]
+        if usage:
+            merged["usage"] = usage
+        merged["continuations"] = rounds
+        return merged
+
+    @staticmethod
+    def _stitch_continuation(text: str, piece: str, max_overlap: int = 400) -> str:
+        """Joins a continuation onto `text`, dropping any prefix of it that repeats the tail."""
+        limit = min(len(text), len(piece), max_overlap)
+        for k in range(limit, 15, -1):
+            if text.endswith(piece[:k]):
+                return text + piece[k:]
+        return text + piece
 
 # Global Instance
 gateway = AIGateway()
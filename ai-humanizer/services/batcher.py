@@ -0,0 +1,166 @@
+import asyncio
+import json
+import re
+from typing import Dict, Any, List, Optional, Tuple
+
+BATCH_SYSTEM_PROMPT = (
+    "You are a batch processor. You receive a JSON object with a list of independent 'tasks'. "
+    "Each task has an 'id', its own 'instructions' and an 'input'. Complete every task on its own, "
+    "following only that task's instructions. Return ONLY strict JSON of the form "
+    "{\"results\": [{\"id\": <task id>, \"output\": <task answer>}]} with exactly one result per task. "
+    "If a task asks for JSON, put that JSON value directly in 'output'; otherwise use a string."
+)
+
+
+class _Pending:
+    def __init__(self, system_prompt: str, prompt: str, max_tokens: int, fut: asyncio.Future):
+        self.system_prompt = system_prompt
+        self.prompt = prompt
+        self.max_tokens = max_tokens
+        self.fut = fut
+        # Packed size, JSON escaping included
+        self.size = len(json.dumps({"id": 0, "instructions": system_prompt, "input": prompt}))
+
+
+class LightBatcher:
+    """
+    Collects small light-model requests for a short window and sends them as
+    one structured JSON prompt, then splits the answer back per caller.
+    Requests are only grouped when temperature matches; anything the batch
+    response does not answer is re-sent on its own.
+    A packed prompt never exceeds `max_chars`, which stays below the
+    gateway's light-model truncation limit so the JSON is never cut.
+    """
+
+    def __init__(self, gateway, window: float = 0.05, max_batch: int = 8,
+                 max_chars: int = 12000, max_output_tokens: int = 8000):
+        self.gateway = gateway
+        self.window = window
+        self.max_batch = max_batch
+        self.max_chars = max_chars
+        self.max_output_tokens = max_output_tokens
+        self._queues: Dict[Tuple, List[_Pending]] = {}
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        # Strong references to in-flight batch runs (the loop only keeps weak ones)
+        self._tasks = set()
+
+    async def submit(self, system_prompt: str, prompt: str, temperature: float,
+                     max_tokens: int, queue: Dict[str, Any]) -> Dict[str, Any]:
+        key = (temperature, queue["priority"], queue["tenant"])
+        fut = asyncio.get_running_loop().create_future()
+        item = _Pending(system_prompt, prompt, max_tokens, fut)
+        if item.size > self.max_chars:
+            # Too large to share a call
+            await self._run_single(item, temperature, queue)
+            return await fut
+
+        # Send what is queued first if this request would push the batch over the limit
+        if sum(p.size for p in self._queues.get(key, [])) + item.size > self.max_chars:
+            self._flush(key)
+        pending = self._queues.setdefault(key, [])
+        pending.append(item)
+
+        size = sum(p.size for p in pending)
+        if len(pending) >= self.max_batch or size >= self.max_chars:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+        return await fut
+
+    def _flush(self, key: Tuple):
+        timer = self._timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self._queues.pop(key, [])
+        if batch:
+            task = asyncio.ensure_future(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Tuple, batch: List[_Pending]):
+        try:
+            await self._run_batch(key, batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Gateway: Batch of {len(batch)} light requests failed: {e}")
+        finally:
+            # No caller may be left waiting, whatever happened above
+            for p in batch:
+                if not p.fut.done():
+                    p.fut.set_result({"error": "Gateway Critical Error: batch request failed", "status_code": 500})
+
+    async def _run_batch(self, key: Tuple, batch: List[_Pending]):
+        temperature, priority, tenant = key
+        queue = {"priority": priority, "tenant": tenant, "queue_timeout": None}
+
+        if len(batch) == 1:
+            await self._run_single(batch[0], temperature, queue)
+            return
+
+        tasks = [
+            {"id": i, "instructions": p.system_prompt, "input": p.prompt}
+            for i, p in enumerate(batch)
+        ]
+        max_tokens = min(self.max_output_tokens, sum(p.max_tokens for p in batch))
+        res = await self.gateway._call(
+            "light", self.gateway._keys(), json.dumps({"tasks": tasks}), BATCH_SYSTEM_PROMPT,
+            temperature, max_tokens, {"type": "json_object"}, queue
+        )
+
+        outputs = self._split(res)
+        print(f"Gateway: Batched {len(batch)} light requests into one call "
+              f"({len(outputs)} answered)")
+        leftovers = []
+        for i, p in enumerate(batch):
+            if p.fut.done():
+                continue
+            if i in outputs:
+                p.fut.set_result({
+                    "choices": [{"message": {"role": "assistant", "content": outputs[i]},
+                                 "finish_reason": "stop"}],
+                    "batched": True
+                })
+            else:
+                leftovers.append(p)
+
+        # Missing or unparseable answers fall back to individual calls
+        await asyncio.gather(*(self._run_single(p, temperature, queue) for p in leftovers))
+
+    async def _run_single(self, p: _Pending, temperature: float, queue: Dict[str, Any]):
+        try:
+            res = await self.gateway._call(
+                "light", self.gateway._keys(), p.prompt, p.system_prompt,
+                temperature, p.max_tokens, None, queue
+            )
+        except Exception as e:
+            res = {"error": f"Gateway Critical Error: {str(e)}", "status_code": 500}
+        if not p.fut.done():
+            p.fut.set_result(res)
+
+    def _split(self, res: Dict[str, Any]) -> Dict[int, str]:
+        if "error" in res:
+            return {}
+        content = res.get("choices", [{}])[0].get("message", {}).get("content", "")
+        content = re.sub(r"```json\s?|\s?```", "", content).strip()
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            return {}
+
+        results = data.get("results") if isinstance(data, dict) else None
+        if not isinstance(results, list):
+            return {}
+        outputs = {}
+        for entry in results:
+            if not isinstance(entry, dict) or "id" not in entry:
+                continue
+            try:
+                idx = int(entry["id"])
+            except (TypeError, ValueError):
+                continue
+            output = entry.get("output")
+            if output is None:
+                continue
+            outputs[idx] = output if isinstance(output, str) else json.dumps(output)
+        return outputs
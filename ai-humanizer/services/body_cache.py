@@ -0,0 +1,56 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Union
+
+
+def content_hash(source: Union[str, bytes]) -> str:
+    """SHA-256 of raw bytes, or of a file's contents read in chunks."""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    h = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class BodyCache:
+    """
+    In-memory LRU of format-independent LEXORA results (metadata, LaTeX body,
+    extracted image names) keyed by the SHA-256 of the uploaded file.
+    Bounded by the total serialized size of the entries; the least recently
+    used documents are evicted first.
+    """
+
+    def __init__(self, max_bytes: Optional[int] = None):
+        self.max_bytes = max_bytes or int(float(os.environ.get("LEXORA_CACHE_MB", "64")) * 1024 * 1024)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        size = len(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        self.discard(key)
+        self._entries[key] = (value, size)
+        self._size += size
+        while self._size > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self._size -= evicted
+
+    def discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def __len__(self) -> int:
+        return len(self._entries)
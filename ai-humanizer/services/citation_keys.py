@@ -0,0 +1,53 @@
+import re
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, Any, Optional
+
+DOI_PREFIX = re.compile(r"^(?:https?://(?:dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+NON_ALNUM = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_doi(doi: Optional[str]) -> Optional[str]:
+    """Lower-cased bare DOI ("10.x/y"), without resolver prefix or trailing punctuation."""
+    if not doi or not isinstance(doi, str):
+        return None
+    doi = DOI_PREFIX.sub("", doi.strip()).strip().rstrip(".,;")
+    return doi.lower() if doi.startswith("10.") else None
+
+
+def normalize_title(title: Optional[str]) -> Optional[str]:
+    """Accent-free, lower-cased title with punctuation collapsed to single spaces."""
+    if not title or not isinstance(title, str):
+        return None
+    text = unicodedata.normalize("NFKD", title)
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = NON_ALNUM.sub(" ", text.lower()).strip()
+    return text or None
+
+
+def first_author_family(item: Dict[str, Any]) -> str:
+    """Normalized family name of the first author ("" when unknown)."""
+    authors = item.get("authors") or []
+    if not authors or not isinstance(authors[0], str):
+        return ""
+    name = authors[0].strip()
+    # "Vaswani, A." vs "A. Vaswani"
+    family = name.split(",")[0] if "," in name else (name.split() or [""])[-1]
+    return normalize_title(family) or ""
+
+
+def title_author_key(item: Dict[str, Any]) -> Optional[str]:
+    title = normalize_title(item.get("title"))
+    if not title:
+        return None
+    return f"{title}|{first_author_family(item)}"
+
+
+def title_similarity(a: Optional[str], b: Optional[str]) -> float:
+    """Similarity in [0, 1] of two titles after normalization."""
+    na, nb = normalize_title(a), normalize_title(b)
+    if not na or not nb:
+        return 0.0
+    if na == nb:
+        return 1.0
+    return SequenceMatcher(None, na, nb).ratio()
@@ -0,0 +1,188 @@
+import re
+from typing import List, Dict, Any, Tuple
+
+# Entry boundaries
+NUMBERED_ENTRY = re.compile(r"^\s*(?:\[(\d{1,3})\]|(\d{1,3})[.)])\s+", re.MULTILINE)
+# "Vaswani, A., ..." at the start of a line (APA / Harvard hanging entries)
+HANGING_ENTRY = re.compile(r"^[A-Z][A-Za-z'\-]+,\s+(?:[A-Z]\.\s*){1,3}", re.MULTILINE)
+
+# Fields
+DOI_RE = re.compile(r"\b(10\.\d{4,9}/[^\s\"<>]+)", re.IGNORECASE)
+URL_RE = re.compile(r"https?://[^\s\"<>]+")
+APA_YEAR_RE = re.compile(r"\((\d{4})[a-z]?(?:,[^)]*)?\)")
+YEAR_RE = re.compile(r"\b((?:19|20)\d{2})[a-z]?\b")
+VOLUME_RE = re.compile(r"\bvol\.\s*(\d+)", re.IGNORECASE)
+ISSUE_RE = re.compile(r"\bno\.\s*(\d+)", re.IGNORECASE)
+PAGES_RE = re.compile(r"\bpp?\.\s*(\d+\s*[-–—]+\s*\d+|\d+)", re.IGNORECASE)
+# APA trailer: "Journal Name, 30(2), 123-145"
+APA_SOURCE_RE = re.compile(r"^(?P<journal>[^,]+?),\s*(?P<volume>\d+)(?:\((?P<issue>[^)]+)\))?(?:,\s*(?P<pages>\d+\s*[-–]\s*\d+|e?\d+))?")
+QUOTED_TITLE_RE = re.compile(r"[“\"](?P<title>.+?)[,.]?[”\"]")
+PROCEEDINGS_RE = re.compile(r"^\s*in\s+(?:Proc\.|Proceedings|Adv\.|Advances)", re.IGNORECASE)
+
+AUTHOR_SPLIT_RE = re.compile(r",\s*(?:and|&)\s+|\s+(?:and|&)\s+|,\s*")
+APA_AUTHOR_RE = re.compile(r"([A-Z][A-Za-z'\-]+(?:\s+[A-Z][A-Za-z'\-]+)*),\s+((?:[A-Z]\.\s*-?\s*){1,4})")
+
+FIELDS = ["authors", "title", "journal", "conference", "year", "volume", "issue", "pages", "doi", "url"]
+
+# Weight of each field in the confidence score
+CONFIDENCE_WEIGHTS = {"title": 0.35, "authors": 0.25, "year": 0.15, "doi": 0.15, "container": 0.1}
+
+
+def split_entries(text: str) -> List[str]:
+    """
+    Splits a reference list into entries on "[1]" / "1." numbering or, failing
+    that, on APA-style hanging entries, blank lines and finally one entry per
+    line. Wrapped lines are joined.
+    """
+    text = text.strip()
+    if not text:
+        return []
+
+    markers = list(NUMBERED_ENTRY.finditer(text))
+    if len(markers) >= 2:
+        entries = []
+        for m, nxt in zip(markers, markers[1:] + [None]):
+            chunk = text[m.end():nxt.start() if nxt else len(text)]
+            entries.append(chunk)
+    elif len(HANGING_ENTRY.findall(text)) >= 2:
+        starts = [m.start() for m in HANGING_ENTRY.finditer(text)]
+        entries = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+    else:
+        entries = []
+        for block in re.split(r"\n\s*\n", text):
+            lines = _split_lines(block)
+            # One reference per line only if every line carries its own year;
+            # otherwise the block is a single wrapped entry
+            entries.extend(lines if all(YEAR_RE.search(line) for line in lines) else [block])
+
+    cleaned = []
+    for entry in entries:
+        entry = re.sub(r"-\n(?=[a-z])", "", entry)
+        entry = re.sub(r"\s+", " ", entry).strip()
+        if len(entry) >= 20:
+            cleaned.append(entry)
+    return cleaned
+
+
+def _split_lines(block: str) -> List[str]:
+    """
+    Unmarked entries pasted one per line. A line continues the previous
+    entry when it starts lowercase / with a digit or the previous line
+    ends mid-sentence (hyphen, comma, "and").
+    """
+    entries = []
+    for line in block.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if entries and (re.match(r"[a-z0-9(]", line) or re.search(r"(?:[-,;:]|\band)$", entries[-1])):
+            entries[-1] = f"{entries[-1]}\n{line}"
+        else:
+            entries.append(line)
+    return entries
+
+
+def _split_ieee_authors(text: str) -> List[str]:
+    text = re.sub(r"\bet al\.?", "", text).strip(" ,.")
+    return [a.strip() for a in AUTHOR_SPLIT_RE.split(text) if a and len(a.strip()) > 1]
+
+
+def _split_apa_authors(text: str) -> List[str]:
+    # "Vaswani, A., Shazeer, N., & Parmar, N." -> ["A. Vaswani", "N. Shazeer", "N. Parmar"]
+    return [" ".join(initials.split() + [family]) for family, initials in APA_AUTHOR_RE.findall(text)]
+
+
+def _parse_ieee(entry: str, item: Dict[str, Any]) -> bool:
+    m = QUOTED_TITLE_RE.search(entry)
+    if not m:
+        return False
+    item["title"] = m.group("title").strip(" ,.")
+    item["authors"] = _split_ieee_authors(entry[:m.start()])
+    rest = entry[m.end():].strip(" ,.")
+    container = re.split(r",\s*(?:vol\.|no\.|pp\.|\d{4}|[A-Z][a-z]{2}\.?\s+\d{4})", rest)[0].strip(" ,.")
+    if container:
+        if PROCEEDINGS_RE.match(container):
+            item["conference"] = re.sub(r"^\s*in\s+", "", container, flags=re.IGNORECASE)
+        else:
+            item["journal"] = container
+    return True
+
+
+def _parse_apa(entry: str, item: Dict[str, Any]) -> bool:
+    m = APA_YEAR_RE.search(entry)
+    if not m:
+        return False
+    authors = _split_apa_authors(entry[:m.start()])
+    if not authors:
+        return False
+    item["authors"] = authors
+    item["year"] = m.group(1)
+    rest = entry[m.end():].lstrip(" .")
+    # Title runs to the first sentence end; the source follows
+    parts = re.split(r"(?<=[a-z0-9?!)])\.\s+", rest, maxsplit=1)
+    item["title"] = parts[0].strip(" .")
+    if len(parts) > 1:
+        src = APA_SOURCE_RE.match(parts[1])
+        if src:
+            item["journal"] = src.group("journal").strip()
+            item["volume"] = src.group("volume")
+            item["issue"] = src.group("issue")
+            item["pages"] = src.group("pages")
+        elif PROCEEDINGS_RE.match(parts[1]):
+            item["conference"] = re.split(r"[,.(]", re.sub(r"^\s*in\s+", "", parts[1], flags=re.IGNORECASE))[0].strip()
+    return True
+
+
+def parse_entry(entry: str) -> Tuple[Dict[str, Any], float]:
+    """
+    Parses one reference with precompiled IEEE / APA patterns.
+    Returns (item in the extraction schema, confidence in [0, 1]).
+    """
+    item: Dict[str, Any] = {f: None for f in FIELDS}
+    item["authors"] = []
+
+    doi = DOI_RE.search(entry)
+    if doi:
+        item["doi"] = doi.group(1).rstrip(".,;)")
+    url = URL_RE.search(entry)
+    if url:
+        item["url"] = url.group(0).rstrip(".,;)")
+
+    # Field patterns must not see the DOI / URL digits
+    body = URL_RE.sub("", DOI_RE.sub("", entry))
+    body = re.sub(r"\b(?:doi|DOI|Available)\s*:?\s*(?=[.,]|$)", "", body).strip(" ,.")
+
+    if not _parse_ieee(body, item):
+        _parse_apa(body, item)
+
+    if not item["year"]:
+        years = YEAR_RE.findall(body)
+        if years:
+            item["year"] = years[-1]
+    for key, pattern in (("volume", VOLUME_RE), ("issue", ISSUE_RE), ("pages", PAGES_RE)):
+        if not item[key]:
+            m = pattern.search(body)
+            if m:
+                item[key] = re.sub(r"\s*[–—]+\s*|\s*-+\s*", "-", m.group(1))
+
+    score = 0.0
+    title = item.get("title") or ""
+    if 3 <= len(title.split()) <= 40:
+        score += CONFIDENCE_WEIGHTS["title"]
+    if item["authors"] and all(1 <= len(a.split()) <= 5 for a in item["authors"]):
+        score += CONFIDENCE_WEIGHTS["authors"]
+    if item["year"]:
+        score += CONFIDENCE_WEIGHTS["year"]
+    if item["doi"]:
+        score += CONFIDENCE_WEIGHTS["doi"]
+    if item["journal"] or item["conference"]:
+        score += CONFIDENCE_WEIGHTS["container"]
+    # Several quoted titles or DOIs: the entry is really more than one reference
+    if len(QUOTED_TITLE_RE.findall(body)) > 1 or len(DOI_RE.findall(entry)) > 1:
+        score = min(score, 0.3)
+    return item, round(score, 2)
+
+
+def parse_references(text: str) -> List[Tuple[str, Dict[str, Any], float]]:
+    """(entry text, parsed item, confidence) for every entry in `text`."""
+    return [(entry, *parse_entry(entry)) for entry in split_entries(text)]
@@ -0,0 +1,52 @@
+from typing import Dict, Optional
+from citeproc import CitationStylesStyle
+
+# Public style names -> CSL style identifiers
+STYLE_ALIASES = {
+    "ieee": "ieee",
+    "apa": "apa",
+    "acm": "acm-siggraph",
+    "chicago": "chicago-author-date",
+    "vancouver": "vancouver"
+}
+
+
+class StyleRegistry:
+    """
+    Parses every supported CSL style once and hands out the parsed objects.
+    Styles are only read while rendering, so one instance is shared by all
+    requests. Styles that fail to load are remembered as unavailable so the
+    manual formatter is used without re-reading the XML each time.
+    """
+
+    def __init__(self, aliases: Optional[Dict[str, str]] = None):
+        self.aliases = dict(aliases or STYLE_ALIASES)
+        self._styles: Dict[str, Optional[CitationStylesStyle]] = {}
+
+    def load(self):
+        for alias, csl_name in self.aliases.items():
+            if csl_name in self._styles:
+                continue
+            try:
+                style = CitationStylesStyle(csl_name, validate=True)
+            except Exception as e:
+                print(f"KARION: CSL style '{csl_name}' failed validation ({e}). Loading without validation.")
+                try:
+                    style = CitationStylesStyle(csl_name, validate=False)
+                except Exception as e2:
+                    print(f"KARION: CSL style '{csl_name}' unavailable: {e2}")
+                    style = None
+            self._styles[csl_name] = style
+        loaded = [name for name, style in self._styles.items() if style is not None]
+        print(f"KARION: Loaded {len(loaded)}/{len(self._styles)} CSL styles")
+
+    def resolve(self, style_name: str) -> str:
+        """Public style name -> alias; unknown names fall back to IEEE."""
+        name = (style_name or "ieee").lower()
+        return name if name in self.aliases else "ieee"
+
+    def get(self, style_name: str) -> Optional[CitationStylesStyle]:
+        csl_name = self.aliases[self.resolve(style_name)]
+        if csl_name not in self._styles:
+            self.load()
+        return self._styles.get(csl_name)
@@ -0,0 +1,76 @@
+import hashlib
+from typing import Dict, Any, List, Optional
+
+from services.citation_keys import normalize_doi, normalize_title, first_author_family
+
+NUM_PERM = 32
+SHINGLE = 3
+# Estimated Jaccard similarity of title shingles above which two entries are the same work
+DUPLICATE_THRESHOLD = 0.8
+
+_MASK = (1 << 64) - 1
+_SEEDS = [int.from_bytes(hashlib.blake2b(str(i).encode(), digest_size=8).digest(), "big") | 1
+          for i in range(NUM_PERM)]
+
+
+def _shingles(text: str) -> set:
+    text = text.replace(" ", "")
+    if len(text) <= SHINGLE:
+        return {text}
+    return {text[i:i + SHINGLE] for i in range(len(text) - SHINGLE + 1)}
+
+
+def minhash(text: str) -> List[int]:
+    """MinHash signature of the character shingles of `text`."""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "big")
+              for s in _shingles(text)]
+    return [min((h * seed) & _MASK for h in hashes) for seed in _SEEDS]
+
+
+def _similarity(a: List[int], b: List[int]) -> float:
+    return sum(1 for x, y in zip(a, b) if x == y) / NUM_PERM
+
+
+class DuplicateIndex:
+    """
+    Incremental near-duplicate detector for extracted references.
+    Two items match on equal normalized DOI, or on equal first author plus
+    MinHash-estimated title similarity above DUPLICATE_THRESHOLD.
+    """
+
+    def __init__(self):
+        self._by_doi: Dict[str, int] = {}
+        # first-author family -> [(index, signature)]
+        self._by_author: Dict[str, List] = {}
+
+    def add(self, index: int, item: Dict[str, Any]) -> Optional[int]:
+        """Registers item `index`; returns the index of the earlier item it duplicates, if any."""
+        doi = normalize_doi(item.get("doi"))
+        if doi and doi in self._by_doi:
+            return self._by_doi[doi]
+
+        title = normalize_title(item.get("title"))
+        original = None
+        signature = None
+        if title:
+            author = first_author_family(item)
+            signature = minhash(title)
+            for other, other_sig in self._by_author.get(author, []):
+                if _similarity(signature, other_sig) >= DUPLICATE_THRESHOLD:
+                    original = other
+                    break
+
+        if original is None:
+            if doi:
+                self._by_doi[doi] = index
+            if signature is not None:
+                self._by_author.setdefault(first_author_family(item), []).append((index, signature))
+        elif doi:
+            self._by_doi.setdefault(doi, original)
+        return original
+
+
+def group_duplicates(items: List[Dict[str, Any]]) -> List[Optional[int]]:
+    """For each item, the index of the first item it duplicates (None for originals)."""
+    index = DuplicateIndex()
+    return [index.add(i, item) for i, item in enumerate(items)]
@@ -0,0 +1,77 @@
+import json
+import re
+from typing import List, Dict, Any
+
+# Where the list of records starts: a known wrapper key, or a bare array of objects
+ARRAY_START = re.compile(r'"(?:references|citations|results|data)"\s*:\s*\[|\[\s*\{')
+
+
+class JSONArrayStreamParser:
+    """
+    Incremental parser for an LLM response containing a JSON array of objects.
+    Text is fed as it streams in; each object is returned as soon as its
+    closing brace arrives, without waiting for the rest of the array.
+    Tolerates conversational preamble and ```json fences around the payload.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.started = False
+        self.finished = False
+        self.count = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._obj_start = -1
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        self.buffer += chunk
+        items = []
+        if self.finished:
+            return items
+
+        if not self.started:
+            match = ARRAY_START.search(self.buffer)
+            if not match:
+                return items
+            self.started = True
+            # Resume just past the opening bracket
+            self.pos = self.buffer.index("[", match.start()) + 1
+
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0 and ch == "{":
+                    self._obj_start = i
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    # Closing bracket of the array itself
+                    self.finished = True
+                    i += 1
+                    break
+                self._depth -= 1
+                if self._depth == 0 and self._obj_start >= 0:
+                    try:
+                        obj = json.loads(buf[self._obj_start:i + 1])
+                        if isinstance(obj, dict):
+                            items.append(obj)
+                            self.count += 1
+                    except json.JSONDecodeError as je:
+                        print(f"JSON stream: skipping malformed element: {je}")
+                    self._obj_start = -1
+            i += 1
+        self.pos = i
+        return items
@@ -1,22 +1,62 @@
 ﻿import json
 import httpx
 import asyncio
+import os
 import re
-from typing import List, Dict, Any, Optional
-from citeproc import CitationStylesStyle, CitationStylesBibliography
+from contextlib import aclosing
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple
+from citeproc import CitationStylesBibliography
 from citeproc import Citation, CitationItem
 from citeproc.source.json import CiteProcJSON
+from services.json_stream import JSONArrayStreamParser
+from services.verification_cache import VerificationCache
+from services.scholarly_index import ScholarlyIndex
+from services.rate_limit import HostRateLimiter
+from services.citation_keys import normalize_doi, title_similarity
+from services.citation_parser import parse_references, split_entries
+from services.csl_styles import StyleRegistry
+from services.dedup import DuplicateIndex, group_duplicates
+
+# Leading label of a numeric style entry: "[1]" (IEEE) or "1. " (Vancouver)
+CITATION_NUMBER_RE = re.compile(r"^(\s*\[?)1(\]|\.\s)")
 
 class KarionService:
     def __init__(self, gateway):
         self.gateway = gateway
         self.crossref_url = "https://api.crossref.org/works"
         self.semantic_scholar_url = "https://api.semanticscholar.org/graph/v1/paper/search"
+        self.cache = VerificationCache()
+        # Offline index (built with `python -m services.scholarly_index`); queried before the network
+        self.index = ScholarlyIndex()
+        # CSL styles are parsed once here and reused by every format_citation call
+        self.styles = StyleRegistry()
+        self.styles.load()
 
-    async def extract_metadata(self, raw_text: str) -> List[Dict[str, Any]]:
-        """
-        Step 1: Extract structured data using AI Gateway (8B model).
-        """
+        # Shared HTTP client, bounded concurrency and per-host pacing for verification
+        self.mailto = os.environ.get("CROSSREF_MAILTO", "")
+        self.verify_concurrency = int(os.environ.get("KARION_VERIFY_CONCURRENCY", "8"))
+        self._verify_sem = asyncio.Semaphore(self.verify_concurrency)
+        self.rate_limiter = HostRateLimiter({
+            "api.crossref.org": float(os.environ.get("KARION_CROSSREF_RPS", "10")),
+            "api.semanticscholar.org": float(os.environ.get("KARION_S2_RPS", "1")),
+        })
+        self._client: Optional[httpx.AsyncClient] = None
+        self.doi_batch_size = 20
+
+        # Entries the rule-based parser scores below this are sent to the LLM
+        self.local_parse_threshold = 0.7
+        # Title similarity a raced search result needs to win before the others finish
+        self.race_min_similarity = 0.9
+        # ~15 typical references per LLM call; the JSON output is several times
+        # larger than the input, so chunks stay small and get a bigger token budget
+        self.extract_chunk_chars = 2500
+        self.extract_max_tokens = 3072
+        # Large bibliographies queue many chunks at once: allow them longer than the
+        # interactive default (15s) to get a slot, and retry a failed chunk once
+        self.extract_queue_timeout = 120.0
+        self.extract_retries = 1
+
+    def _extraction_prompts(self, raw_text: str):
         system_prompt = (
             "You are an academic metadata extractor. Extract citation details from the provided text. "
             "Return a JSON object with a key 'references' containing a list of objects. Each citation object should have these fields: "
@@ -25,113 +65,677 @@ class KarionService:
             "Example: {\"references\": [{\"authors\": [\"A. Vaswani\"], \"title\": \"Attention...\", ...}]}"
         )
         
-        # Taking first 5000 chars to avoid overload
-        prompt = f"Extract metadata from these references:\n\n{raw_text[:5000]}"
+        # Callers pass one chunk from _chunk_entries, so nothing is cut here
+        prompt = f"Extract metadata from these references:\n\n{raw_text}"
+        return system_prompt, prompt
+
+    def _chunk_entries(self, raw_text: str) -> List[str]:
+        """
+        Packs whole reference entries into chunks that fit one light-model call,
+        so long bibliographies are extracted in parallel instead of truncated.
+        """
+        if len(raw_text) <= self.extract_chunk_chars:
+            return [raw_text] if raw_text.strip() else []
+
+        entries = self._split_for_chunks(raw_text)
+        return ["\n".join(entries[i] for i in group) for group in self._pack_entries(entries)]
+
+    def _split_for_chunks(self, raw_text: str) -> List[str]:
+        entries = split_entries(raw_text)
+        if len(entries) <= 1:
+            # No entry boundaries found: fall back to line boundaries
+            entries = [line for line in raw_text.splitlines() if line.strip()]
+        return entries
+
+    def _pack_entries(self, entries: List[str]) -> List[List[int]]:
+        """Greedily groups entry indices into chunks of at most extract_chunk_chars."""
+        groups, current, size = [], [], 0
+        for i, entry in enumerate(entries):
+            if current and size + len(entry) + 1 > self.extract_chunk_chars:
+                groups.append(current)
+                current, size = [], 0
+            current.append(i)
+            size += len(entry) + 1
+        if current:
+            groups.append(current)
+        return groups
+
+    async def extract_metadata(self, raw_text: str, failed: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Step 1: Extract structured data.
+        Regular IEEE/APA entries are parsed locally; only the entries the
+        rule-based parser is unsure about go to the AI Gateway (8B model).
+        The raw text of chunks that still fail after retrying is appended
+        to `failed`, so callers can report them.
+        """
+        parsed = parse_references(raw_text)
+        if not parsed:
+            return await self._llm_extract(raw_text, failed)
+
+        items = [item if score >= self.local_parse_threshold else None for _, item, score in parsed]
+        low = [i for i, item in enumerate(items) if item is None]
+        print(f"KARION: Parsed {len(parsed) - len(low)}/{len(parsed)} references locally")
+        if not low:
+            return items
+
+        entries = [parsed[i][0] for i in low]
+        groups = self._pack_entries(entries)
+        chunks = ["\n".join(entries[g] for g in group) for group in groups]
+        results = await asyncio.gather(*(self._llm_extract_chunk(c) for c in chunks))
+        # Slot AI results back into the original order chunk by chunk, so a failed
+        # chunk leaves only its own entries empty; any surplus goes last
+        surplus = []
+        for group, chunk, chunk_items in zip(groups, chunks, results):
+            if chunk_items is None:
+                if failed is not None:
+                    failed.append(chunk)
+                continue
+            for g, llm_item in zip(group, chunk_items):
+                items[low[g]] = llm_item
+            surplus.extend(chunk_items[len(group):])
+        items.extend(surplus)
+        return [item for item in items if item is not None]
+
+    async def _llm_extract(self, raw_text: str, failed: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        chunks = self._chunk_entries(raw_text)
+        if len(chunks) > 1:
+            print(f"KARION: Extracting {len(chunks)} chunks concurrently")
+        results = await asyncio.gather(*(self._llm_extract_chunk(c) for c in chunks))
+        for chunk, chunk_items in zip(chunks, results):
+            if chunk_items is None and failed is not None:
+                failed.append(chunk)
+        # gather keeps chunk order, so the bibliography order survives
+        return [item for chunk_items in results if chunk_items for item in chunk_items]
+
+    async def _llm_extract_chunk(self, raw_text: str) -> Optional[List[Dict[str, Any]]]:
+        """Items of one chunk, or None if every attempt failed."""
+        system_prompt, prompt = self._extraction_prompts(raw_text)
         
+        for attempt in range(self.extract_retries + 1):
+            try:
+                res = await self.gateway.generate(
+                    model_type="light",
+                    system_prompt=system_prompt,
+                    prompt=prompt,
+                    max_tokens=self.extract_max_tokens,
+                    hedge=True,
+                    priority="interactive",
+                    tenant="karion",
+                    queue_timeout=self.extract_queue_timeout,
+                    continue_on_length=True
+                )
+                
+                if "error" in res:
+                    print(f"KARION: Chunk extraction attempt {attempt + 1} failed: {res['error']}")
+                    continue
+
+                content = res.get("choices", [{}])[0].get("message", {}).get("content", "[]")
+                
+                print(f"KARION: AI response received ({len(content)} chars)")
+                final_items = self._parse_references(content)
+                print(f"KARION: Successfully extracted {len(final_items)} references")
+                return final_items
+            except Exception as e:
+                print(f"KARION: Metadata extraction critical error: {e}")
+        return None
+
+    async def stream_metadata(self, raw_text: str,
+                              failed: Optional[List[str]] = None) -> AsyncIterator[Tuple[Tuple[int, int], Dict[str, Any]]]:
+        """
+        Streaming variant of Step 1: yields each reference as soon as the model
+        has finished writing it, so verification can start on reference 1
+        while later ones are still being generated. Locally parsed entries
+        are yielded first. Chunks that fail are appended to `failed`.
+        Items come as (position, item): position is (entry index, n) and
+        sorts in source order, whatever order the items arrive in.
+        """
+        parsed = parse_references(raw_text)
+        low = []
+        for i, (entry, item, score) in enumerate(parsed):
+            if score >= self.local_parse_threshold:
+                yield (i, 0), item
+            else:
+                low.append(i)
+        if parsed and not low:
+            return
+
+        if parsed:
+            entries = [parsed[i][0] for i in low]
+        elif len(raw_text) <= self.extract_chunk_chars:
+            entries = [raw_text] if raw_text.strip() else []
+        else:
+            entries = self._split_for_chunks(raw_text)
+        positions = low if parsed else list(range(len(entries)))
+
+        # Chunks stream concurrently; references are yielded in arrival order
+        queue: asyncio.Queue = asyncio.Queue()
+        groups = self._pack_entries(entries)
+
+        async def pump(group: List[int]):
+            chunk = "\n".join(entries[g] for g in group)
+            try:
+                n = 0
+                async with aclosing(self._stream_chunk(chunk, failed)) as items:
+                    async for item in items:
+                        # The n-th item of a chunk belongs to its n-th entry; any surplus sorts after the last one
+                        if n < len(group):
+                            position = (positions[group[n]], 0)
+                        else:
+                            position = (positions[group[-1]], n - len(group) + 1)
+                        await queue.put((position, item))
+                        n += 1
+            finally:
+                await queue.put(None)
+
+        tasks = [asyncio.create_task(pump(g)) for g in groups]
         try:
-            res = await self.gateway.generate(
+            remaining = len(tasks)
+            while remaining:
+                item = await queue.get()
+                if item is None:
+                    remaining -= 1
+                else:
+                    yield item
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _stream_chunk(self, raw_text: str, failed: Optional[List[str]] = None) -> AsyncIterator[Dict[str, Any]]:
+        system_prompt, prompt = self._extraction_prompts(raw_text)
+        parser = JSONArrayStreamParser()
+        content = ""
+        status: Dict[str, Any] = {}
+        yielded = 0
+        complete = False
+        try:
+            # aclosing: an abandoned stream must hand its scheduler slot back immediately
+            async with aclosing(self.gateway.generate_stream(
                 model_type="light",
                 system_prompt=system_prompt,
-                prompt=prompt
-            )
-            
-            if "error" in res:
-                return []
+                prompt=prompt,
+                max_tokens=self.extract_max_tokens,
+                priority="interactive",
+                tenant="karion",
+                queue_timeout=self.extract_queue_timeout,
+                status=status
+            )) as deltas:
+                async for delta in deltas:
+                    content += delta
+                    for item in parser.feed(delta):
+                        yielded += 1
+                        yield item
 
-            content = res.get("choices", [{}])[0].get("message", {}).get("content", "[]")
-            
-            print(f"KARION: AI response received ({len(content)} chars)")
-            
-            # Extract JSON from potential conversational text
-            json_match = re.search(r"(\{.*\}|\[.*\])", content, re.DOTALL)
-            if json_match:
-                content = json_match.group(0)
-            
-            try:
-                data = json.loads(content)
-            except Exception as je:
-                print(f"KARION: JSON parse error: {je}")
-                # Try a more aggressive cleanup
-                clean_content = content.replace("```json", "").replace("```", "").strip()
-                data = json.loads(clean_content)
-            
-            # Ensure it's a list of dicts
-            final_items = []
-            if isinstance(data, dict):
-                # Sometimes LLM returns {"references": [...]}
-                for key in ["references", "citations", "results", "data"]:
-                    if key in data and isinstance(data[key], list):
-                        final_items = data[key]
-                        break
-                if not final_items:
-                    final_items = [data]
-            elif isinstance(data, list):
-                final_items = data
-            
-            # Final sanity check: filter out non-dict items
-            final_items = [item for item in final_items if isinstance(item, dict)]
-            
-            print(f"KARION: Successfully extracted {len(final_items)} references")
-            return final_items
+            # Output that never formed an array (e.g. a single object): parse it whole
+            if parser.count == 0 and content:
+                for item in self._parse_references(content):
+                    yielded += 1
+                    yield item
+            print(f"KARION: Streamed {yielded} references ({len(content)} chars, {status.get('finish_reason')})")
+            complete = bool(content) and status.get("finish_reason") not in ("length", "error")
         except Exception as e:
-            print(f"KARION: Metadata extraction critical error: {e}")
-            return []
+            print(f"KARION: Metadata streaming critical error: {e}")
+
+        if complete:
+            return
+        # Nothing streamed (queue deadline, upstream error), output cut at max_tokens or
+        # unparseable: extract the chunk without streaming (with continuation) and emit
+        # only the references after the ones already yielded
+        items = await self._llm_extract_chunk(raw_text)
+        if items is None:
+            if failed is not None:
+                failed.append(raw_text)
+            return
+        for item in items[yielded:]:
+            yield item
 
-    async def verify_metadata(self, item: Dict[str, Any], mode: str = "standard") -> Dict[str, Any]:
+    def _parse_references(self, content: str) -> List[Dict[str, Any]]:
+        # Extract JSON from potential conversational text
+        json_match = re.search(r"(\{.*\}|\[.*\])", content, re.DOTALL)
+        if json_match:
+            content = json_match.group(0)
+        
+        try:
+            data = json.loads(content)
+        except Exception as je:
+            print(f"KARION: JSON parse error: {je}")
+            # Try a more aggressive cleanup
+            clean_content = content.replace("```json", "").replace("```", "").strip()
+            data = json.loads(clean_content)
+        
+        # Ensure it's a list of dicts
+        final_items = []
+        if isinstance(data, dict):
+            # Sometimes LLM returns {"references": [...]}
+            for key in ["references", "citations", "results", "data"]:
+                if key in data and isinstance(data[key], list):
+                    final_items = data[key]
+                    break
+            if not final_items:
+                final_items = [data]
+        elif isinstance(data, list):
+            final_items = data
+        
+        # Final sanity check: filter out non-dict items
+        return [item for item in final_items if isinstance(item, dict)]
+
+    async def verify_metadata(self, item: Dict[str, Any], mode: str = "standard",
+                              race: bool = False) -> Dict[str, Any]:
         """
         Step 2: Verify against Crossref/Semantic Scholar.
+        Results (matches and misses) are cached on disk, and the offline
+        scholarly index is tried next, so the network is only hit on a miss.
         """
         if mode == "quick":
             return item
 
+        cached = await self.cache.aget(item, mode)
+        if cached is not None:
+            verified_data = item.copy()
+            verified_data.update(cached)
+            return verified_data
+
+        local = await self._lookup_index(item)
+        if local is not None:
+            return local
+
+        verified_data, conclusive = await self._verify_online(item, mode, race=race)
+        if conclusive:
+            await self.cache.aput(item, verified_data, mode)
+        return verified_data
+
+    async def verify_many(self, items: List[Dict[str, Any]], mode: str = "standard",
+                          race: bool = False) -> List[Dict[str, Any]]:
+        """
+        Step 2 for a whole bibliography. Near-duplicate entries are grouped
+        first and each work is verified once; later copies share the result
+        and are flagged with "duplicate_of" (index of the first copy).
+        """
+        duplicate_of = group_duplicates(items)
+        originals = [i for i, d in enumerate(duplicate_of) if d is None]
+        if len(originals) < len(items):
+            print(f"KARION: {len(items) - len(originals)} duplicate references skipped")
+
+        verified = await self._verify_unique([items[i] for i in originals], mode, race)
+        by_index = dict(zip(originals, verified))
+        return [
+            by_index[i] if d is None else {**by_index[d], "duplicate_of": d}
+            for i, d in enumerate(duplicate_of)
+        ]
+
+    def duplicate_groups(self, items: List[Dict[str, Any]]) -> List[List[int]]:
+        """
+        Index groups of the entries verify_many flagged as the same work.
+        Indices refer to the extracted reference list, before format_citation
+        drops the duplicates from "metadata".
+        """
+        groups: Dict[int, List[int]] = {}
+        for i, item in enumerate(items):
+            if item.get("duplicate_of") is not None:
+                groups.setdefault(item["duplicate_of"], [item["duplicate_of"]]).append(i)
+        return list(groups.values())
+
+    async def _verify_unique(self, items: List[Dict[str, Any]], mode: str, race: bool = False) -> List[Dict[str, Any]]:
+        """
+        References with DOIs are resolved with a handful of Crossref
+        `filter=doi:...` list queries instead of one request each; only the
+        rest go through per-item title search.
+        """
+        if mode == "quick":
+            return list(items)
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        pending = []
+        cached_results = await self.cache.aget_many(items, mode)
+        uncached = []
+        for i, item in enumerate(items):
+            cached = cached_results[i]
+            if cached is not None:
+                results[i] = {**item, **cached}
+            else:
+                uncached.append(i)
+        hits = await asyncio.gather(*(self._lookup_index(items[i]) for i in uncached))
+        for i, hit in zip(uncached, hits):
+            results[i] = hit
+            if hit is None:
+                pending.append(i)
+
+        dois = {normalize_doi(items[i].get("doi")) for i in pending} - {None}
+        found, batched = await self._lookup_dois_batch(sorted(dois))
+
+        singles = []
+        found_entries = []
+        for i in pending:
+            item = items[i]
+            doi = normalize_doi(item.get("doi"))
+            if doi in found:
+                verified_data = item.copy()
+                self._merge_crossref(verified_data, found[doi])
+                verified_data["verified"] = True
+                found_entries.append((item, verified_data))
+                results[i] = verified_data
+            else:
+                # A DOI the list query answered for (and did not find) need not be fetched again
+                singles.append((i, doi in batched))
+        await self.cache.aput_many(found_entries, mode)
+
+        async def verify_single(i: int, skip_doi: bool):
+            verified_data, conclusive = await self._verify_online(items[i], mode, skip_doi=skip_doi, race=race)
+            if conclusive:
+                await self.cache.aput(items[i], verified_data, mode)
+            results[i] = verified_data
+
+        await asyncio.gather(*(verify_single(i, skip) for i, skip in singles))
+        return results
+
+    async def verify_stream(self, raw_text: str, mode: str = "standard", style_name: str = "ieee",
+                            race: bool = False) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming pipeline for /karion/verify/stream. Each reference is verified
+        as soon as extraction yields it and emitted as a "reference" frame once
+        formatted, so a slow lookup only delays its own frame. A final
+        "summary" frame carries the full formatted list and BibTeX.
+        """
+        out: asyncio.Queue = asyncio.Queue()
+        verified: Dict[int, Dict[str, Any]] = {}
+        positions: Dict[int, Tuple[int, int]] = {}
+        tasks = []
+
+        duplicates = DuplicateIndex()
+        failed_chunks: List[str] = []
+
+        async def verify(index: int, item: Dict[str, Any], original: Optional[int]):
+            if original is not None:
+                # Same work as an earlier entry: share its verification
+                await tasks[original]
+                result = {**verified[original], "duplicate_of": original}
+            else:
+                try:
+                    result = await self.verify_metadata(item, mode=mode, race=race)
+                except Exception as e:
+                    print(f"KARION Verification Error: {e}")
+                    result = {**item, "verified": False}
+            verified[index] = result
+            await out.put({
+                "type": "reference",
+                "index": index,
+                "position": positions[index][0],
+                "formatted": self.format_single(result, style_name, number=positions[index][0] + 1),
+                "metadata": result
+            })
+
+        async def produce():
+            try:
+                index = 0
+                async with aclosing(self.stream_metadata(raw_text, failed_chunks)) as items:
+                    async for position, item in items:
+                        positions[index] = position
+                        original = duplicates.add(index, item)
+                        tasks.append(asyncio.create_task(verify(index, item, original)))
+                        index += 1
+                await asyncio.gather(*tasks)
+            finally:
+                await out.put(None)
+
+        producer = asyncio.create_task(produce())
+        try:
+            while True:
+                frame = await out.get()
+                if frame is None:
+                    break
+                yield frame
+        finally:
+            producer.cancel()
+            for task in tasks:
+                task.cancel()
+
+        # Summary in source order, not arrival order; duplicate_of is remapped to that order
+        order = sorted(verified, key=lambda i: positions[i])
+        rank = {index: n for n, index in enumerate(order)}
+        items = []
+        for index in order:
+            item = verified[index]
+            if item.get("duplicate_of") is not None:
+                item = {**item, "duplicate_of": rank[item["duplicate_of"]]}
+            items.append(item)
+        if not items:
+            summary = {"type": "summary", "formatted": [], "bibtex": "", "metadata": [],
+                       "warning": "No citations found or failed to parse."}
+            if failed_chunks:
+                summary["failed_chunks"] = failed_chunks
+            yield summary
+            return
+        summary = self.format_citation(items, style_name=style_name)
+        summary["duplicates"] = self.duplicate_groups(items)
+        if failed_chunks:
+            summary["failed_chunks"] = failed_chunks
+            summary["warning"] = f"{len(failed_chunks)} reference chunk(s) could not be extracted."
+        summary["type"] = "summary"
+        yield summary
+
+    async def _lookup_index(self, item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Offline scholarly index match (fuzzy on title), or None on a miss."""
+        if not self.index.available:
+            return None
+        # SQLite FTS queries block: run them off the event loop
+        hit = await asyncio.to_thread(self.index.lookup, item)
+        if hit is None:
+            return None
+        record, score = hit
+        verified_data = item.copy()
+        verified_data.update({k: v for k, v in record.items() if v})
+        verified_data["verified"] = True
+        verified_data["match_score"] = round(score, 3)
+        return verified_data
+
+    async def _lookup_dois_batch(self, dois: List[str]):
+        """
+        Crossref list queries, `doi_batch_size` DOIs per request.
+        Returns ({doi: record}, set of DOIs whose batch answered successfully).
+        """
+        found: Dict[str, Dict[str, Any]] = {}
+        answered = set()
+        # Commas would split the filter value, so such DOIs take the single-item path
+        dois = [d for d in dois if "," not in d]
+        chunks = [dois[i:i + self.doi_batch_size] for i in range(0, len(dois), self.doi_batch_size)]
+
+        async def fetch(chunk: List[str]):
+            params = {"filter": ",".join(f"doi:{d}" for d in chunk), "rows": len(chunk)}
+            try:
+                async with self._verify_sem:
+                    res = await self._get(self.crossref_url, params=params)
+                if res.status_code != 200:
+                    print(f"KARION: DOI batch lookup got {res.status_code}")
+                    return
+                for record in res.json().get("message", {}).get("items", []):
+                    doi = normalize_doi(record.get("DOI"))
+                    if doi:
+                        found[doi] = record
+                answered.update(chunk)
+            except Exception as e:
+                print(f"KARION: DOI batch lookup error: {e}")
+
+        await asyncio.gather(*(fetch(c) for c in chunks))
+        if chunks:
+            print(f"KARION: Resolved {len(found)}/{len(dois)} DOIs in {len(chunks)} batch queries")
+        return found, answered
+
+    async def _verify_online(self, item: Dict[str, Any], mode: str, skip_doi: bool = False,
+                             race: bool = False):
+        """
+        Network lookups. Returns (verified_data, conclusive); a lookup that
+        errored out is not conclusive and must not be cached as a miss.
+        `skip_doi` is set when a batch query already looked the DOI up.
+        With `race`, all strategies run concurrently (see _race_online).
+        """
+        if race:
+            return await self._race_online(item, mode, skip_doi)
+
         doi = item.get("doi")
         title = item.get("title")
         
         verified_data = item.copy()
+        conclusive = True
 
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
+            async with self._verify_sem:
                 # 1. Try DOI directly
-                if doi:
-                    doi_clean = doi.strip().replace("https://doi.org/", "")
-                    res = await client.get(f"{self.crossref_url}/{doi_clean}")
-                    if res.status_code == 200:
-                        cr_data = res.json().get("message", {})
-                        self._merge_crossref(verified_data, cr_data)
+                if doi and not skip_doi:
+                    record, ok = await self._lookup_doi(doi)
+                    conclusive = conclusive and ok
+                    if record:
+                        self._merge_crossref(verified_data, record)
                         verified_data["verified"] = True
-                        return verified_data
+                        return verified_data, True
 
                 # 2. Try Title Search
                 if title:
-                    params = {"query.title": title, "rows": 1}
-                    if item.get("authors") and len(item["authors"]) > 0:
-                        params["query.author"] = item["authors"][0]
-                    
-                    res = await client.get(self.crossref_url, params=params)
-                    if res.status_code == 200:
-                        items = res.json().get("message", {}).get("items", [])
-                        if items:
-                            self._merge_crossref(verified_data, items[0])
-                            verified_data["verified"] = True
-                            return verified_data
+                    record, ok = await self._search_crossref_title(item)
+                    conclusive = conclusive and ok
+                    if record:
+                        self._merge_crossref(verified_data, record)
+                        verified_data["verified"] = True
+                        return verified_data, True
 
                 # 3. Fallback to Semantic Scholar if requested and no match yet
-                if mode == "strict" and not verified_data.get("verified") and title:
-                    params = {"query": title, "limit": 1, "fields": "title,authors,year,journal,externalIds,url"}
-                    res = await client.get(self.semantic_scholar_url, params=params)
-                    if res.status_code == 200:
-                        papers = res.json().get("data", [])
-                        if papers:
-                            self._merge_semantic(verified_data, papers[0])
-                            verified_data["verified"] = True
-                            return verified_data
+                if mode == "strict" and title:
+                    record, ok = await self._search_semantic(title)
+                    conclusive = conclusive and ok
+                    if record:
+                        self._merge_semantic(verified_data, record)
+                        verified_data["verified"] = True
+                        return verified_data, True
 
         except Exception as e:
             print(f"KARION Verification Error: {e}")
+            verified_data["verified"] = False
+            return verified_data, False
         
         verified_data["verified"] = False
+        return verified_data, conclusive
+
+    async def _race_online(self, item: Dict[str, Any], mode: str, skip_doi: bool = False):
+        """
+        Starts the DOI lookup, Crossref title search and (strict mode) Semantic
+        Scholar search together. The first confident match wins and the other
+        lookups are cancelled: a DOI hit is always confident, a title search
+        hit only if its title is similar enough to ours. Without a confident
+        match, the best result is picked in the sequential order.
+        """
+        doi = item.get("doi")
+        title = item.get("title")
+        verified_data = item.copy()
+
+        lookups = {}
+        if doi and not skip_doi:
+            lookups["doi"] = self._lookup_doi(doi)
+        if title:
+            lookups["crossref"] = self._search_crossref_title(item)
+        if mode == "strict" and title:
+            lookups["semantic"] = self._search_semantic(title)
+
+        conclusive = True
+        found: Dict[str, Dict[str, Any]] = {}
+        async with self._verify_sem:
+            tasks = {asyncio.create_task(coro): name for name, coro in lookups.items()}
+            pending = set(tasks)
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        name = tasks[task]
+                        try:
+                            record, ok = task.result()
+                        except Exception as e:
+                            print(f"KARION Verification Error ({name}): {e}")
+                            record, ok = None, False
+                        conclusive = conclusive and ok
+                        if not record:
+                            continue
+                        found[name] = record
+                        if name == "doi" or self._title_matches(title, record) >= self.race_min_similarity:
+                            pending.clear()
+                            return self._apply_match(verified_data, name, record), True
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+        for name in ("doi", "crossref", "semantic"):
+            if name in found:
+                return self._apply_match(verified_data, name, found[name]), True
+
+        verified_data["verified"] = False
+        return verified_data, conclusive
+
+    def _title_matches(self, title: Optional[str], record: Dict[str, Any]) -> float:
+        record_title = record.get("title")
+        if isinstance(record_title, list):
+            record_title = record_title[0] if record_title else None
+        return title_similarity(title, record_title)
+
+    def _apply_match(self, verified_data: Dict[str, Any], source: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        if source == "semantic":
+            self._merge_semantic(verified_data, record)
+        else:
+            self._merge_crossref(verified_data, record)
+        verified_data["verified"] = True
         return verified_data
 
+    def _get_client(self) -> httpx.AsyncClient:
+        """Shared pooled client: one TLS handshake per host instead of one per reference."""
+        if self._client is None or self._client.is_closed:
+            agent = "ALTRIX-KARION/1.0"
+            if self.mailto:
+                agent += f" (mailto:{self.mailto})"
+            self._client = httpx.AsyncClient(
+                timeout=10.0,
+                headers={"User-Agent": agent},
+                limits=httpx.Limits(max_connections=self.verify_concurrency,
+                                    max_keepalive_connections=self.verify_concurrency)
+            )
+        return self._client
+
+    async def _get(self, url: str, params: Optional[Dict[str, Any]] = None) -> httpx.Response:
+        host = httpx.URL(url).host
+        params = dict(params or {})
+        # Crossref "polite pool": identify ourselves so we are not throttled as anonymous traffic
+        if self.mailto and host == "api.crossref.org":
+            params["mailto"] = self.mailto
+        await self.rate_limiter.wait(host)
+        return await self._get_client().get(url, params=params or None)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _lookup_doi(self, doi: str):
+        """Crossref works/{doi}. Returns (record or None, conclusive)."""
+        doi_clean = doi.strip().replace("https://doi.org/", "")
+        res = await self._get(f"{self.crossref_url}/{doi_clean}")
+        if res.status_code == 200:
+            return res.json().get("message", {}), True
+        # Throttling or server errors mean "unknown", not "not found"
+        return None, res.status_code == 404
+
+    async def _search_crossref_title(self, item: Dict[str, Any]):
+        params = {"query.title": item["title"], "rows": 1}
+        if item.get("authors") and len(item["authors"]) > 0:
+            params["query.author"] = item["authors"][0]
+        
+        res = await self._get(self.crossref_url, params=params)
+        if res.status_code == 200:
+            items = res.json().get("message", {}).get("items", [])
+            return (items[0] if items else None), True
+        return None, res.status_code == 404
+
+    async def _search_semantic(self, title: str):
+        params = {"query": title, "limit": 1, "fields": "title,authors,year,journal,externalIds,url"}
+        res = await self._get(self.semantic_scholar_url, params=params)
+        if res.status_code == 200:
+            papers = res.json().get("data", [])
+            return (papers[0] if papers else None), True
+        return None, res.status_code == 404
+
     def _merge_crossref(self, target: Dict, source: Dict):
         target["title"] = source.get("title", [target.get("title")])[0]
         target["doi"] = source.get("DOI", target.get("doi"))
@@ -153,12 +757,75 @@ class KarionService:
         if "authors" in source:
             target["authors"] = [a.get("name", "") for a in source["authors"]]
 
-    def format_citation(self, items: List[Dict[str, Any]], style_name: str = "ieee") -> Dict[str, Any]:
+    def format_citation(self, items: List[Dict[str, Any]], style_name: str = "ieee",
+                        styles: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Step 3 & 4: Format using citeproc-py.
-        Note: style_name should be an alias or path to CSL.
-        For simplicity, we'll map common styles to built-in or standard names.
+        Note: style_name should be an alias (ieee, apa, acm, chicago, vancouver).
+        Extra `styles` are rendered from the same CSL items and returned under
+        "formatted_styles"; parsed styles come from the preloaded registry.
+        Entries flagged "duplicate_of" are left out of "formatted", "metadata"
+        and the BibTeX, so formatted[i] and metadata[i] describe the same work.
         """
+        unique = [item for item in items if item.get("duplicate_of") is None]
+        csl_items = self._to_csl_items(unique)
+
+        try:
+            # Render every requested style from the same CSL item list
+            requested = [style_name] + [st for st in (styles or []) if st.lower() != style_name.lower()]
+            formatted_styles = {}
+            for name in requested:
+                formatted_styles[self.styles.resolve(name)] = self._render_style(csl_items, unique, name)
+            formatted_list = formatted_styles[self.styles.resolve(style_name)]
+
+            # Generate BibTeX manually for reliability
+            bibtex_entries = []
+            used_keys: Dict[str, int] = {}
+            for item in unique:
+                # Use year if available, otherwise 'n.d.'
+                year_val = item.get('year', 'n.d.')
+                # Create a reliable key
+                author_key = "ref"
+                if item.get("authors"):
+                    last_name = item["authors"][0].split()[-1]
+                    author_key = "".join(filter(str.isalnum, last_name)).lower()
+                
+                cite_key = f"{author_key}{year_val}"
+                # Different works by the same first author and year: smith2020, smith2020a, ...
+                seen = used_keys.get(cite_key, 0)
+                used_keys[cite_key] = seen + 1
+                if seen:
+                    cite_key += chr(ord("a") + seen - 1) if seen <= 26 else str(seen)
+                
+                entry = f"@article{{{cite_key},\n"
+                entry += f"  author = {{{' and '.join(item.get('authors', []))}}},\n"
+                entry += f"  title = {{{item.get('title')}}},\n"
+                if item.get("journal"): entry += f"  journal = {{{item.get('journal')}}},\n"
+                if item.get("year"): entry += f"  year = {{{item.get('year')}}},\n"
+                if item.get("doi"): entry += f"  doi = {{{item.get('doi')}}},\n"
+                if item.get("url"): entry += f"  url = {{{item.get('url')}}},\n"
+                entry += "}"
+                bibtex_entries.append(entry)
+
+            result = {
+                "formatted": formatted_list,
+                "bibtex": "\n\n".join(bibtex_entries),
+                "metadata": unique
+            }
+            if styles:
+                result["formatted_styles"] = formatted_styles
+            return result
+
+        except Exception as e:
+            print(f"KARION Formatting Error: {e}")
+            return {
+                "formatted": self._manual_format(unique, style_name),
+                "bibtex": "Failed to generate BibTeX",
+                "metadata": unique,
+                "warning": str(e)
+            }
+
+    def _to_csl_items(self, items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         # Mapping to CSL field names
         csl_items = []
         for i, item in enumerate(items):
@@ -197,71 +864,36 @@ class KarionService:
             # Remove None values
             csl_item = {k: v for k, v in csl_item.items() if v is not None}
             csl_items.append(csl_item)
+        return csl_items
 
-        try:
-            # Try to use citeproc-py
-            try:
-                alias_map = {
-                    "ieee": "ieee",
-                    "apa": "apa",
-                    "acm": "acm-siggraph",
-                    "chicago": "chicago-author-date",
-                    "vancouver": "vancouver"
-                }
-                actual_style = alias_map.get(style_name.lower(), "ieee")
-                
-                # Fix: Initialize bib_source
-                bib_source = CiteProcJSON(csl_items)
-                
-                style = CitationStylesStyle(actual_style, validate=False)
-                bibliography = CitationStylesBibliography(style, bib_source, formatter=None)
-                
-                for item in csl_items:
-                    citation = Citation([CitationItem(item["id"])])
-                    bibliography.register(citation)
-                
-                formatted_list = [str(item) for item in bibliography.bibliography()]
-            except Exception as e:
-                print(f"KARION CiteProc failed: {e}. Using fallback.")
-                formatted_list = self._manual_format(items, style_name)
-
-            # Generate BibTeX manually for reliability
-            bibtex_entries = []
-            for item in items:
-                # Use year if available, otherwise 'n.d.'
-                year_val = item.get('year', 'n.d.')
-                # Create a reliable key
-                author_key = "ref"
-                if item.get("authors"):
-                    last_name = item["authors"][0].split()[-1]
-                    author_key = "".join(filter(str.isalnum, last_name)).lower()
-                
-                cite_key = f"{author_key}{year_val}"
-                
-                entry = f"@article{{{cite_key},\n"
-                entry += f"  author = {{{' and '.join(item.get('authors', []))}}},\n"
-                entry += f"  title = {{{item.get('title')}}},\n"
-                if item.get("journal"): entry += f"  journal = {{{item.get('journal')}}},\n"
-                if item.get("year"): entry += f"  year = {{{item.get('year')}}},\n"
-                if item.get("doi"): entry += f"  doi = {{{item.get('doi')}}},\n"
-                if item.get("url"): entry += f"  url = {{{item.get('url')}}},\n"
-                entry += "}"
-                bibtex_entries.append(entry)
-
-            return {
-                "formatted": formatted_list,
-                "bibtex": "\n\n".join(bibtex_entries),
-                "metadata": items
-            }
+    def format_single(self, item: Dict[str, Any], style_name: str = "ieee", number: int = 1) -> str:
+        """
+        One formatted reference, used for progressive (streamed) results.
+        `number` is its place in the reference list, used by numeric styles.
+        """
+        formatted = self._render_style(self._to_csl_items([item]), [item], style_name)
+        if not formatted:
+            return ""
+        if number == 1:
+            return formatted[0]
+        return CITATION_NUMBER_RE.sub(lambda m: f"{m.group(1)}{number}{m.group(2)}", formatted[0], count=1)
 
+    def _render_style(self, csl_items: List[Dict[str, Any]], items: List[Dict[str, Any]], style_name: str) -> List[str]:
+        style = self.styles.get(style_name)
+        if style is None:
+            return self._manual_format(items, self.styles.resolve(style_name))
+        try:
+            bib_source = CiteProcJSON(csl_items)
+            bibliography = CitationStylesBibliography(style, bib_source, formatter=None)
+            
+            for item in csl_items:
+                citation = Citation([CitationItem(item["id"])])
+                bibliography.register(citation)
+            
+            return [str(item) for item in bibliography.bibliography()]
         except Exception as e:
-            print(f"KARION Formatting Error: {e}")
-            return {
-                "formatted": self._manual_format(items, style_name),
-                "bibtex": "Failed to generate BibTeX",
-                "metadata": items,
-                "warning": str(e)
-            }
+            print(f"KARION CiteProc failed: {e}. Using fallback.")
+            return self._manual_format(items, self.styles.resolve(style_name))
 
     def _manual_format(self, items: List[Dict], style: str) -> List[str]:
         """Simple template-based academic formatting."""
@@ -1,6 +1,25 @@
+import asyncio
 import json
 import re
-from typing import Dict, Any, Optional
+import time
+from typing import Dict, Any, List, Optional, Tuple, Union
+
+from document_reader import extract_document
+from header_parser import HEADER_CONFIDENCE_THRESHOLD
+from image_store import get_image_store
+from services.body_cache import BodyCache, content_hash
+from services.pipeline import StageGraph
+
+# Section headings on their own line: "2. Related Work", "III. METHOD", "Introduction"
+SECTION_HEADING_RE = re.compile(
+    r"^[ \t]*(?:(?:\d+(?:\.\d+)*\.?|[IVX]+\.)[ \t]+[A-Z][^\n.]{0,80}"
+    r"|(?i:Abstract|Introduction|Related Work|Background|Methods?|Methodology|Experiments?|"
+    r"Results|Discussion|Conclusions?|References|Bibliography|Acknowledge?ments?|Appendix)[ \t]*:?)[ \t]*$",
+    re.MULTILINE
+)
+LABEL_RE = re.compile(r"\\label\{([^}]*)\}")
+# Commands whose argument names a label
+REF_RE = re.compile(r"\\(ref|eqref|pageref|autoref|cref|Cref|nameref)\{([^}]*)\}")
 
 class LexoraService:
     def __init__(self, gateway):
@@ -47,100 +66,261 @@ class LexoraService:
 {{BODY}}
 \\end{document}""",
         }
+        # ~3k tokens of source per heavy call, with room for the LaTeX it expands to
+        self.section_chunk_chars = 10000
+        self.section_max_tokens = 4096
+        # A failed section is retried this many times before it is reported as failed
+        self.section_retries = 1
+        # Format-independent results per uploaded file, so format switches only re-render
+        self.cache = BodyCache()
 
-    async def _extract_metadata(self, text: str) -> Dict[str, Any]:
+    async def _extract_metadata(self, text: str, header: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
-        Multi-pass ML-style extraction for high precision.
-        Pass 1: Broad extraction
-        Pass 2: JSON Verification & Refinement
+        Title/author extraction.
+        Uses the local layout-based header parse when it is confident enough,
+        otherwise a single light-model pass over the paper head.
         """
-        # Pass 1: Broad extraction
-        broad_prompt = (
-            "You are an Advanced Research Header Parser. Extract the EXACT Title and Authors from this paper.\n"
+        if header and header.get("confidence", 0) >= HEADER_CONFIDENCE_THRESHOLD:
+            print(f"LEXORA: Header parsed locally (confidence {header['confidence']})")
+            return {"title": header["title"], "authors": header["authors"]}
+
+        prompt = (
+            "You are an Advanced Research Header Parser. Extract the EXACT Title and Authors from this paper, "
+            "exactly as written, with author names cleaned of affiliation marks.\n"
             "Format: JSON { 'title': '...', 'authors': ['...', '...'] }\n"
-            "Be extremely literal."
+            "Be extremely literal. Return clean JSON."
         )
+        head = f"Paper Head:\n\n{text[:3000]}"
+        if header and header.get("title"):
+            head += f"\n\nLayout hint (may be wrong): {json.dumps({'title': header['title'], 'authors': header['authors']})}"
         try:
             res = await self.gateway.generate(
                 model_type="light",
-                system_prompt=broad_prompt,
-                prompt=f"Paper Head:\n\n{text[:3000]}"
+                system_prompt=prompt,
+                prompt=head,
+                tenant="lexora",
+                batchable=True
             )
             raw = res.get("choices", [{}])[0].get("message", {}).get("content", "{}").strip()
             raw = re.sub(r"```json\s?|\s?```", "", raw)
-            data = json.loads(raw)
-            
-            # Pass 2: Refinement
-            refine_prompt = (
-                "Verify and clean this research metadata. Ensure names are formatted correctly "
-                "and the title is exactly as written in the paper.\n"
-                "Return clean JSON."
-            )
-            res_refine = await self.gateway.generate(
-                model_type="light",
-                system_prompt=refine_prompt,
-                prompt=f"Original: {text[:2000]}\nExtracted: {json.dumps(data)}"
-            )
-            refined_raw = res_refine.get("choices", [{}])[0].get("message", {}).get("content", "{}").strip()
-            refined_raw = re.sub(r"```json\s?|\s?```", "", refined_raw)
-            return json.loads(refined_raw)
+            return json.loads(raw)
         except:
+            if header and header.get("title"):
+                return {"title": header["title"], "authors": header["authors"] or ["Unknown Researchers"]}
             return {"title": "Unknown Research Title", "authors": ["Unknown Researchers"]}
 
-    async def process_text(self, text: str, format_type: str, options: Dict[str, Any]) -> Dict[str, Any]:
+    def _split_sections(self, text: str) -> List[str]:
         """
-        Structures research text into LaTeX using the specified format.
-        Uses the V2.5 high-volume engine (30k char context).
+        Splits the paper on detected section headings and packs consecutive
+        sections into chunks of at most `section_chunk_chars`, in order.
         """
-        # Stage 1: metadata
-        metadata = await self._extract_metadata(text)
+        starts = [m.start() for m in SECTION_HEADING_RE.finditer(text)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        sections = [text[a:b].strip() for a, b in zip(starts, starts[1:] + [len(text)])]
+
+        chunks, current = [], ""
+        for section in filter(None, sections):
+            # A single oversized section is cut on paragraph boundaries
+            while len(section) > self.section_chunk_chars:
+                cut = section.rfind("\n\n", 0, self.section_chunk_chars)
+                if cut <= 0:
+                    cut = self.section_chunk_chars
+                if current:
+                    chunks.append(current)
+                    current = ""
+                chunks.append(section[:cut].strip())
+                section = section[cut:].strip()
+            if current and len(current) + len(section) + 2 > self.section_chunk_chars:
+                chunks.append(current)
+                current = ""
+            current = f"{current}\n\n{section}" if current else section
+        if current:
+            chunks.append(current)
+        return chunks
 
-        # Stage 2: Full Body
-        images = options.get("images", [])
+    async def _generate_body(self, text: str, images: List[str]) -> Tuple[str, List[int]]:
+        """LaTeX body and the indices of the section chunks that could not be converted."""
+        chunks = self._split_sections(text)
+        if len(chunks) > 1:
+            print(f"LEXORA: Converting {len(chunks)} section chunks concurrently")
+        parts = await asyncio.gather(*(
+            self._generate_section(chunk, i, len(chunks), images)
+            for i, chunk in enumerate(chunks)
+        ))
+        failed = [i for i, part in enumerate(parts) if part is None]
+        return self._stitch(parts), failed
+
+    async def _generate_section(self, chunk: str, index: int, total: int, images: List[str]) -> Optional[str]:
         images_str = ", ".join(images) if images else "None"
-        
+        if index == 0:
+            position = "1. This is the START of the paper: begin with \\begin{abstract} if it has an abstract.\n"
+        else:
+            position = f"1. This is part {index + 1} of {total}; continue the paper, do NOT repeat the abstract.\n"
         body_prompt = (
             f"You are LEXORA V2.5, an AI-ML Academic Structuring Engine.\n"
-            f"Task: Generate the COMPLETE Body for a '{format_type}' LaTeX document.\n"
+            f"Task: Convert part {index + 1} of {total} of a paper into the Body of a LaTeX document.\n"
+            "The body must be template-neutral (standard LaTeX only); the journal template is applied separately.\n"
             "MANDATORY:\n"
-            "1. Start with \\begin{abstract}.\n"
-            "2. Follow with all sections (Introduction through References).\n"
-            "3. Use LaTeX syntax strictly.\n"
-            f"4. Integrate Figures: {images_str}. Identify where they fit and insert \\includegraphics.\n"
-            "5. NO PREAMBLE, NO TITLE, NO AUTHORS - Just the body content starting with abstract.\n"
-            "6. DO NOT CUT OFF. Generate the entire paper."
+            + position +
+            "2. Convert every section in this part (\\section / \\subsection), keeping all of its content.\n"
+            "3. Use LaTeX syntax strictly. Label each section \\label{sec:<heading-in-lowercase-with-hyphens>}.\n"
+            f"4. Integrate Figures: {images_str}. Only insert \\includegraphics for figures this part discusses.\n"
+            "5. NO PREAMBLE, NO TITLE, NO AUTHORS, NO \\end{document} - Just the body content of this part.\n"
+            "6. DO NOT CUT OFF. Generate the entire part."
         )
-
-        try:
-            body_res = await self.gateway.generate(
+        for attempt in range(self.section_retries + 1):
+            res = await self.gateway.generate(
                 model_type="heavy",
                 system_prompt=body_prompt,
-                prompt=f"PAPER CONTENT (30k chars):\n\n{text[:30000]}"
+                prompt=f"PAPER CONTENT (part {index + 1}/{total}):\n\n{chunk}",
+                max_tokens=self.section_max_tokens,
+                hedge=True,
+                priority="bulk",
+                tenant="lexora",
+                continue_on_length=True
             )
+            if "error" in res:
+                print(f"LEXORA: Section {index + 1}/{total} failed (attempt {attempt + 1}): {res['error']}")
+                continue
+            if res.get("continuations"):
+                print(f"LEXORA: Section {index + 1}/{total} needed {res['continuations']} continuation(s)")
+            content = res.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
+            content = content.replace("```latex", "").replace("```", "").strip()
+            if content:
+                return content
+            print(f"LEXORA: Section {index + 1}/{total} came back empty (attempt {attempt + 1})")
+        return None
 
-            body_content = body_res.get("choices", [{}])[0].get("message", {}).get("content", "").strip()
-            body_content = body_content.replace("```latex", "").replace("```", "").strip()
-
-            template = self.templates.get(format_type, self.templates["IEEE"])
-            
-            authors = metadata.get("authors", [])
-            if format_type == "IEEE":
-                authors_latex = "\\IEEEauthorblockN{" + ", ".join(authors) + "}"
-            else:
-                authors_latex = ", ".join(authors)
-            
-            full_latex = template
-            full_latex = full_latex.replace("{{TITLE}}", metadata.get("title", "Unknown Title"))
-            full_latex = full_latex.replace("{{AUTHORS}}", authors_latex)
-            full_latex = full_latex.replace("{{BODY}}", body_content)
-            
-            if "{{SHORTTITLE}}" in full_latex:
-                short_title = metadata.get("title", "Research")[:50]
-                full_latex = full_latex.replace("{{SHORTTITLE}}", short_title)
+    def _stitch(self, parts: List[Optional[str]]) -> str:
+        """
+        Joins converted parts in order, keeping labels unique and each figure once.
+        A label already used by an earlier part is renamed, together with the
+        references to it inside the same part. Failed parts (None) leave a
+        LaTeX comment in their place.
+        """
+        seen_labels: Dict[str, int] = {}
+        stitched = []
+        for i, part in enumerate(parts):
+            if part is None:
+                stitched.append(f"% LEXORA: part {i + 1} of {len(parts)} could not be converted")
+                continue
+            if not part:
+                continue
+            renamed: Dict[str, str] = {}
+            for label in dict.fromkeys(LABEL_RE.findall(part)):
+                seen_labels[label] = seen_labels.get(label, 0) + 1
+                if seen_labels[label] > 1:
+                    renamed[label] = f"{label}-{seen_labels[label]}"
+            if renamed:
+                part = LABEL_RE.sub(lambda m: f"\\label{{{renamed.get(m.group(1), m.group(1))}}}", part)
+                part = REF_RE.sub(
+                    lambda m: f"\\{m.group(1)}{{{','.join(renamed.get(k.strip(), k) for k in m.group(2).split(','))}}}",
+                    part
+                )
+            stitched.append(part)
+        body = "\n\n".join(stitched)
 
+        seen_figures = set()
+        def dedupe_figure(m):
+            graphic = re.search(r"\\includegraphics(?:\[[^\]]*\])?\{([^}]*)\}", m.group(0))
+            if not graphic:
+                return m.group(0)
+            if graphic.group(1) in seen_figures:
+                return ""
+            seen_figures.add(graphic.group(1))
+            return m.group(0)
+        body = re.sub(r"\\begin\{figure\*?\}.*?\\end\{figure\*?\}", dedupe_figure, body, flags=re.DOTALL)
+        return body
+
+    async def process_document(self, filename: str, source: Union[str, bytes], format_type: str,
+                               options: Dict[str, Any], image_dir: str, refresh: bool = False,
+                               digest: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Full upload pipeline as a stage graph:
+            document ─┬── metadata ──┐
+                      └── body ──────┴── render
+        The document stage (text, images and header from a single parse) runs
+        in a worker thread; metadata and body run concurrently after it.
+        Per-stage timings are returned.
+        Metadata and body are cached by file hash: converting the same file to
+        another format only re-renders the template unless `refresh` is set.
+        `source` is the spooled upload's path (or raw bytes); `digest` is its
+        SHA-256 when the caller already computed it while streaming.
+        """
+        key = digest or content_hash(source)
+        cached = None if refresh else self.cache.get(key)
+        # The cached body names store images: refresh their LRU time, and rebuild
+        # the entry if garbage collection already removed any of them
+        if cached is not None and not get_image_store(image_dir).touch(cached["images"]):
+            print(f"LEXORA: Cached images for {key[:12]} were collected, rebuilding")
+            self.cache.discard(key)
+            cached = None
+        if cached is not None:
+            t0 = time.monotonic()
+            latex = self._render(format_type, cached["metadata"], cached["body"])
+            print(f"LEXORA: Cache hit for {key[:12]}, re-rendering as {format_type}")
             return {
-                "latex": full_latex,
-                "metadata": metadata
+                "latex": latex,
+                "metadata": cached["metadata"],
+                "extracted_images": cached["images"],
+                "extraction_method": cached["extraction_method"],
+                "timings": {"render": round(time.monotonic() - t0, 3)},
+                "cached": True
             }
-        except Exception as e:
-            raise e
+
+        async def metadata(r):
+            return await self._extract_metadata(r["document"]["text"], r["document"]["header"])
+
+        async def body(r):
+            return await self._generate_body(r["document"]["text"], r["document"]["images"])
+
+        graph = StageGraph()
+        graph.add("document", lambda r: extract_document(filename, source, image_dir))
+        graph.add("metadata", metadata, deps=["document"])
+        graph.add("body", body, deps=["document"])
+
+        t0 = time.monotonic()
+        results, timings = await graph.run()
+        timings["total"] = round(time.monotonic() - t0, 3)
+
+        body_content, failed_sections = results["body"]
+        # A body with failed sections is not cached, so the next upload retries them
+        if body_content and not failed_sections:
+            self.cache.put(key, {
+                "metadata": results["metadata"],
+                "body": body_content,
+                "images": results["document"]["images"],
+                "extraction_method": results["document"]["method"]
+            })
+        result = {
+            "latex": self._render(format_type, results["metadata"], body_content),
+            "metadata": results["metadata"],
+            "extracted_images": results["document"]["images"],
+            "extraction_method": results["document"]["method"],
+            "timings": timings,
+            "cached": False
+        }
+        if failed_sections:
+            # Indices of section chunks missing from the LaTeX (a comment marks each one)
+            result["failed_sections"] = failed_sections
+        return result
+
+    def _render(self, format_type: str, metadata: Dict[str, Any], body_content: str) -> str:
+        template = self.templates.get(format_type, self.templates["IEEE"])
+        
+        authors = metadata.get("authors", [])
+        if format_type == "IEEE":
+            authors_latex = "\\IEEEauthorblockN{" + ", ".join(authors) + "}"
+        else:
+            authors_latex = ", ".join(authors)
+        
+        full_latex = template
+        full_latex = full_latex.replace("{{TITLE}}", metadata.get("title", "Unknown Title"))
+        full_latex = full_latex.replace("{{AUTHORS}}", authors_latex)
+        full_latex = full_latex.replace("{{BODY}}", body_content)
+        
+        if "{{SHORTTITLE}}" in full_latex:
+            short_title = metadata.get("title", "Research")[:50]
+            full_latex = full_latex.replace("{{SHORTTITLE}}", short_title)
+        return full_latex
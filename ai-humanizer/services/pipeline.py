@@ -0,0 +1,51 @@
+import asyncio
+import inspect
+import time
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+
+class StageGraph:
+    """
+    Small dependency graph of pipeline stages.
+    - Each stage starts as soon as all of its dependencies have finished
+    - Stages receive the results dict and read their inputs by stage name
+    - Async stages run on the event loop, plain functions in a worker thread
+    - Wall-clock time of every stage is recorded
+    """
+
+    def __init__(self):
+        self._stages: Dict[str, Tuple[Callable, Tuple[str, ...]]] = {}
+
+    def add(self, name: str, fn: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = ()):
+        deps = tuple(deps)
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self._stages[name] = (fn, deps)
+        return self
+
+    async def run(self) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        results: Dict[str, Any] = {}
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(name: str):
+            fn, deps = self._stages[name]
+            if deps:
+                await asyncio.gather(*(tasks[d] for d in deps))
+            t0 = time.monotonic()
+            if inspect.iscoroutinefunction(fn):
+                results[name] = await fn(results)
+            else:
+                results[name] = await asyncio.to_thread(fn, results)
+            timings[name] = round(time.monotonic() - t0, 3)
+
+        # Stages are registered after their dependencies, so every task can find its deps
+        for name in self._stages:
+            tasks[name] = asyncio.create_task(run_stage(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+        return results, timings
@@ -0,0 +1,26 @@
+import asyncio
+import time
+from typing import Dict
+
+
+class HostRateLimiter:
+    """
+    Spaces out requests per host so bursts never exceed `rate` requests/second.
+    Callers reserve the next free send slot and sleep until it comes up.
+    """
+
+    def __init__(self, rates: Dict[str, float], default_rate: float = 5.0):
+        self.rates = rates
+        self.default_rate = default_rate
+        self._next_slot: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, host: str):
+        interval = 1.0 / self.rates.get(host, self.default_rate)
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, 0.0))
+            self._next_slot[host] = slot + interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
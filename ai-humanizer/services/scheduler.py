@@ -0,0 +1,127 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+# Relative share of freed slots each class receives while all are backlogged
+PRIORITY_WEIGHTS = {
+    "interactive": 8,
+    "standard": 3,
+    "bulk": 1,
+}
+
+# Maximum time (s) a request may wait for a slot before failing fast
+DEFAULT_QUEUE_DEADLINES = {
+    "interactive": 15.0,
+    "standard": 60.0,
+    "bulk": 180.0,
+}
+
+
+class QueueTimeout(Exception):
+    """Raised when a request could not get a slot before its queue deadline."""
+
+
+class _PriorityClass:
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.pass_value = 0.0
+        # tenant -> deque of waiter futures, rotated round-robin
+        self.tenants: "OrderedDict[str, deque]" = OrderedDict()
+
+    def has_waiters(self) -> bool:
+        return bool(self.tenants)
+
+    def push(self, tenant: str, fut: asyncio.Future):
+        self.tenants.setdefault(tenant, deque()).append(fut)
+
+    def pop(self) -> Optional[asyncio.Future]:
+        """Next live waiter, taking one from each tenant in turn."""
+        while self.tenants:
+            tenant, queue = self.tenants.popitem(last=False)
+            fut = None
+            while queue:
+                candidate = queue.popleft()
+                if not candidate.done():
+                    fut = candidate
+                    break
+            if queue:
+                # Tenant still has work: move it to the back of the rotation
+                self.tenants[tenant] = queue
+            if fut is not None:
+                return fut
+        return None
+
+
+class FairScheduler:
+    """
+    Concurrency limiter with weighted fair queueing.
+    - Priority classes share freed slots by weight (stride scheduling)
+    - Tenants inside a class are served round-robin
+    - Waiters fail fast with QueueTimeout once their deadline passes
+    """
+
+    def __init__(self, capacity: int, weights: Optional[Dict[str, int]] = None,
+                 deadlines: Optional[Dict[str, float]] = None):
+        self.capacity = capacity
+        self.in_use = 0
+        self.deadlines = dict(deadlines or DEFAULT_QUEUE_DEADLINES)
+        self.classes = {name: _PriorityClass(w) for name, w in (weights or PRIORITY_WEIGHTS).items()}
+
+    def _waiting(self) -> bool:
+        return any(c.has_waiters() for c in self.classes.values())
+
+    def _dispatch(self):
+        while self.in_use < self.capacity:
+            backlogged = [c for c in self.classes.values() if c.has_waiters()]
+            if not backlogged:
+                return
+            cls = min(backlogged, key=lambda c: c.pass_value)
+            fut = cls.pop()
+            if fut is None:
+                continue
+            cls.pass_value += 1.0 / cls.weight
+            self.in_use += 1
+            fut.set_result(None)
+
+    async def acquire(self, priority: str = "standard", tenant: Optional[str] = None,
+                      timeout: Optional[float] = None):
+        if priority not in self.classes:
+            priority = "standard"
+        cls = self.classes[priority]
+        if self.in_use < self.capacity and not self._waiting():
+            self.in_use += 1
+            return
+
+        # A class returning from idle must not cash in credit it built up while empty
+        active = [c.pass_value for c in self.classes.values() if c.has_waiters()]
+        if not cls.has_waiters() and active:
+            cls.pass_value = max(cls.pass_value, min(active))
+
+        fut = asyncio.get_running_loop().create_future()
+        cls.push(tenant or "default", fut)
+        # Clears abandoned waiters and grants immediately if a slot is free
+        self._dispatch()
+        if timeout is None:
+            timeout = self.deadlines.get(priority)
+
+        t0 = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                # Slot was granted just as the deadline hit: hand it back
+                self.release()
+            else:
+                fut.cancel()
+            raise QueueTimeout(f"{priority} request waited {time.monotonic() - t0:.1f}s without a slot")
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release()
+            else:
+                fut.cancel()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self._dispatch()
@@ -0,0 +1,286 @@
+"""
+Offline scholarly index for KARION title verification.
+
+Build from Crossref / OpenAlex snapshot files or BibTeX libraries:
+    python -m services.scholarly_index --crossref crossref-part-001.jsonl.gz \
+        --openalex works-part-000.gz --bibtex library.bib
+"""
+import argparse
+import gzip
+import json
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+
+from services.citation_keys import (
+    normalize_doi, normalize_title, first_author_family, title_author_key, title_similarity
+)
+
+# Fields handed back to KarionService (same as the Crossref merge writes)
+RECORD_FIELDS = ["title", "doi", "url", "year", "journal", "authors"]
+
+# Title words too common to narrow a full-text search
+STOP_WORDS = frozenset(
+    "a an and are as at by for from how in into is its of on or the their to towards using via what when "
+    "which with without new based study analysis approach method methods toward through under over".split()
+)
+# Most distinctive (longest) title terms used in a full-text query
+MAX_QUERY_TERMS = 12
+
+BIBTEX_ENTRY_RE = re.compile(r"@(\w+)\s*\{\s*[^,]*,(.*?)\n\}", re.DOTALL)
+BIBTEX_FIELD_RE = re.compile(r"(\w+)\s*=\s*(?:\{((?:[^{}]|\{[^{}]*\})*)\}|\"([^\"]*)\"|(\d+))", re.DOTALL)
+
+
+def _open(path: str):
+    return gzip.open(path, "rt", encoding="utf-8") if path.endswith(".gz") else open(path, encoding="utf-8")
+
+
+def _unwrap(doc: Any) -> Iterator[Dict[str, Any]]:
+    if isinstance(doc, list):
+        for entry in doc:
+            yield from _unwrap(entry)
+    elif isinstance(doc, dict):
+        items = doc.get("items") or (doc.get("message") or {}).get("items")
+        if isinstance(items, list):
+            yield from (entry for entry in items if isinstance(entry, dict))
+        else:
+            yield doc
+
+
+def _json_objects(path: str) -> Iterator[Dict[str, Any]]:
+    """Works from JSON-lines files or single JSON documents (Crossref snapshots wrap them in "items")."""
+    with _open(path) as f:
+        first = f.readline().strip()
+        f.seek(0)
+        if first in ("{", "["):
+            # Pretty-printed single document
+            yield from _unwrap(json.load(f))
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield from _unwrap(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+
+
+def crossref_records(path: str) -> Iterator[Dict[str, Any]]:
+    for work in _json_objects(path):
+        title = (work.get("title") or [None])[0]
+        if not title:
+            continue
+        yield {
+            "title": title,
+            "doi": work.get("DOI"),
+            "url": work.get("URL"),
+            "year": (work.get("issued") or work.get("created") or {}).get("date-parts", [[None]])[0][0],
+            "journal": (work.get("container-title") or [None])[0],
+            "authors": [f"{a.get('given', '')} {a.get('family', '')}".strip() for a in work.get("author", [])],
+        }
+
+
+def openalex_records(path: str) -> Iterator[Dict[str, Any]]:
+    for work in _json_objects(path):
+        title = work.get("title") or work.get("display_name")
+        if not title:
+            continue
+        source = ((work.get("primary_location") or {}).get("source") or {})
+        yield {
+            "title": title,
+            "doi": work.get("doi"),
+            "url": work.get("doi") or work.get("id"),
+            "year": work.get("publication_year"),
+            "journal": source.get("display_name"),
+            "authors": [(a.get("author") or {}).get("display_name", "") for a in work.get("authorships", [])],
+        }
+
+
+def bibtex_records(path: str) -> Iterator[Dict[str, Any]]:
+    with _open(path) as f:
+        text = f.read()
+    for m in BIBTEX_ENTRY_RE.finditer(text):
+        fields = {}
+        for fm in BIBTEX_FIELD_RE.finditer(m.group(2)):
+            value = next(v for v in fm.groups()[1:] if v is not None)
+            fields[fm.group(1).lower()] = re.sub(r"[{}]", "", re.sub(r"\s+", " ", value)).strip()
+        if not fields.get("title"):
+            continue
+        authors = []
+        for name in re.split(r"\s+and\s+", fields.get("author", "")):
+            # "Vaswani, Ashish" -> "Ashish Vaswani"
+            if "," in name:
+                family, given = [p.strip() for p in name.split(",", 1)]
+                name = f"{given} {family}"
+            if name.strip():
+                authors.append(name.strip())
+        yield {
+            "title": fields["title"],
+            "doi": fields.get("doi"),
+            "url": fields.get("url"),
+            "year": fields.get("year"),
+            "journal": fields.get("journal") or fields.get("booktitle"),
+            "authors": authors,
+        }
+
+
+class ScholarlyIndex:
+    """
+    On-disk SQLite FTS5 index of scholarly works.
+    Lookups try the normalized DOI first, then a full-text search on the
+    normalized title whose candidates are re-scored by title similarity
+    plus a first-author bonus.
+    """
+
+    def __init__(self, path: Optional[str] = None, min_score: float = 0.9):
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    ".cache", "scholarly_index.sqlite3")
+        self.path = path or os.environ.get("KARION_INDEX_PATH") or default_path
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._conn = None
+        # Lookups are read-only: one connection per thread, so they run in parallel
+        self._local = threading.local()
+
+    @property
+    def available(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS works ("
+                "id INTEGER PRIMARY KEY, key TEXT UNIQUE, doi TEXT, norm_title TEXT, "
+                "author_key TEXT, record TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS works_doi ON works(doi);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS works_fts USING fts5("
+                "norm_title, author_key, content='works', content_rowid='id');"
+            )
+            self._conn = conn
+        return self._conn
+
+    def add_records(self, records: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+        """Inserts records (KARION item schema); duplicates by DOI or title+author are skipped."""
+        added = 0
+        with self._lock:
+            conn = self._connect()
+            batch = []
+
+            def flush():
+                nonlocal added
+                with conn:
+                    for row in batch:
+                        cur = conn.execute(
+                            "INSERT OR IGNORE INTO works (key, doi, norm_title, author_key, record) "
+                            "VALUES (?, ?, ?, ?, ?)", row
+                        )
+                        if cur.rowcount:
+                            conn.execute(
+                                "INSERT INTO works_fts (rowid, norm_title, author_key) VALUES (?, ?, ?)",
+                                (cur.lastrowid, row[2], row[3])
+                            )
+                            added += 1
+                batch.clear()
+
+            for record in records:
+                norm_title = normalize_title(record.get("title"))
+                if not norm_title:
+                    continue
+                doi = normalize_doi(record.get("doi"))
+                record = {k: record.get(k) for k in RECORD_FIELDS}
+                record["doi"] = doi or record.get("doi")
+                key = f"doi:{doi}" if doi else f"ta:{title_author_key(record)}"
+                batch.append((key, doi, norm_title, first_author_family(record), json.dumps(record)))
+                if len(batch) >= batch_size:
+                    flush()
+            if batch:
+                flush()
+        return added
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False, timeout=5.0)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _query_terms(norm_title: str) -> List[str]:
+        """Distinctive title terms, longest (rarest) first, without stop words."""
+        words = list(dict.fromkeys(norm_title.split()))
+        terms = [t for t in words if len(t) > 2 and t not in STOP_WORDS] or words
+        return sorted(terms, key=len, reverse=True)[:MAX_QUERY_TERMS]
+
+    def _search(self, conn: sqlite3.Connection, terms: List[str], operator: str = "AND") -> List[Tuple[str, str]]:
+        query = f" {operator} ".join(f'"{t}"' for t in terms)
+        return conn.execute(
+            "SELECT w.record, w.author_key FROM works_fts f JOIN works w ON w.id = f.rowid "
+            "WHERE works_fts MATCH ? ORDER BY bm25(works_fts) LIMIT 20",
+            (f"norm_title : ({query})",)
+        ).fetchall()
+
+    def lookup(self, item: Dict[str, Any]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """
+        Best (record, score) for `item`, or None when nothing scores above min_score.
+        Blocking; async callers run it in a worker thread.
+        """
+        if not self.available:
+            return None
+        try:
+            conn = self._reader()
+            doi = normalize_doi(item.get("doi"))
+            if doi:
+                row = conn.execute("SELECT record FROM works WHERE doi = ?", (doi,)).fetchone()
+                if row:
+                    return json.loads(row[0]), 1.0
+
+            norm_title = normalize_title(item.get("title"))
+            if not norm_title:
+                return None
+            terms = self._query_terms(norm_title)
+            # AND first: only titles containing every distinctive term are candidates
+            rows = self._search(conn, terms)
+            if not rows and len(terms) > 1:
+                # A misspelled / OCR-damaged word: any distinctive term, still capped by bm25 LIMIT
+                rows = self._search(conn, terms, "OR")
+        except Exception as e:
+            print(f"KARION Index lookup error: {e}")
+            return None
+
+        author = first_author_family(item)
+        best = None
+        for record_json, author_key in rows:
+            record = json.loads(record_json)
+            score = title_similarity(item.get("title"), record.get("title"))
+            if author and author_key:
+                score = 0.85 * score + (0.15 if author == author_key else 0.0)
+            if best is None or score > best[1]:
+                best = (record, score)
+        if best and best[1] >= self.min_score:
+            return best
+        return None
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build the KARION offline scholarly index.")
+    parser.add_argument("--index", help="Index path (default: KARION_INDEX_PATH or .cache/scholarly_index.sqlite3)")
+    parser.add_argument("--crossref", nargs="*", default=[], help="Crossref snapshot files (.json/.jsonl[.gz])")
+    parser.add_argument("--openalex", nargs="*", default=[], help="OpenAlex works files (.jsonl[.gz])")
+    parser.add_argument("--bibtex", nargs="*", default=[], help="BibTeX libraries")
+    args = parser.parse_args(argv)
+
+    index = ScholarlyIndex(args.index)
+    sources = [(crossref_records, args.crossref), (openalex_records, args.openalex), (bibtex_records, args.bibtex)]
+    for reader, paths in sources:
+        for path in paths:
+            added = index.add_records(reader(path))
+            print(f"Indexed {added} works from {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from services.citation_keys import normalize_doi, title_author_key
+
+# Fields written by KarionService._merge_crossref / _merge_semantic
+CACHED_FIELDS = ["title", "doi", "url", "year", "journal", "authors"]
+
+# Strict mode also consults Semantic Scholar, so its misses are more conclusive
+MODE_RANK = {"standard": 1, "strict": 2}
+
+
+class VerificationCache:
+    """
+    Persistent SQLite cache of Crossref/Semantic Scholar verification results.
+    Entries are keyed on the normalized DOI and on normalized title + first author.
+    Matches live for `positive_ttl`, misses for the shorter `negative_ttl`.
+    Expired rows are purged on first use and then at most every `purge_interval`.
+    The a* coroutines run the SQLite work in a worker thread, off the event loop.
+    """
+
+    def __init__(self, path: Optional[str] = None,
+                 positive_ttl: float = 30 * 24 * 3600,
+                 negative_ttl: float = 24 * 3600,
+                 purge_interval: float = 3600):
+        default_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                    ".cache", "karion_verify.sqlite3")
+        self.path = path or os.environ.get("KARION_CACHE_PATH") or default_path
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.purge_interval = purge_interval
+        self._last_purge = 0.0
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS verification ("
+                "key TEXT PRIMARY KEY, record TEXT NOT NULL, verified INTEGER NOT NULL, "
+                "mode TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS verification_expires ON verification(expires_at)")
+            self._conn = conn
+            self._purge(conn)
+        return self._conn
+
+    def _purge(self, conn: sqlite3.Connection):
+        """Deletes expired rows. Caller holds the lock."""
+        now = time.time()
+        with conn:
+            deleted = conn.execute("DELETE FROM verification WHERE expires_at <= ?", (now,)).rowcount
+        self._last_purge = now
+        if deleted:
+            print(f"KARION Cache: Purged {deleted} expired entries")
+
+    def keys_for(self, item: Dict[str, Any]) -> List[str]:
+        keys = []
+        doi = normalize_doi(item.get("doi"))
+        if doi:
+            keys.append(f"doi:{doi}")
+        ta = title_author_key(item)
+        if ta:
+            keys.append(f"ta:{ta}")
+        return keys
+
+    def get(self, item: Dict[str, Any], mode: str = "standard") -> Optional[Dict[str, Any]]:
+        """Cached verification fields for `item`, or None on a miss."""
+        keys = self.keys_for(item)
+        if not keys:
+            return None
+        try:
+            with self._lock:
+                conn = self._connect()
+                now = time.time()
+                for key in keys:
+                    row = conn.execute(
+                        "SELECT record, verified, mode FROM verification WHERE key = ? AND expires_at > ?",
+                        (key, now)
+                    ).fetchone()
+                    if not row:
+                        continue
+                    record, verified, cached_mode = row
+                    # A miss in standard mode says nothing about a strict lookup
+                    if not verified and MODE_RANK.get(cached_mode, 0) < MODE_RANK.get(mode, 0):
+                        continue
+                    return json.loads(record)
+        except Exception as e:
+            print(f"KARION Cache read error: {e}")
+        return None
+
+    def _rows(self, item: Dict[str, Any], verified_data: Dict[str, Any], mode: str) -> List[Tuple]:
+        verified = bool(verified_data.get("verified"))
+        record = {k: verified_data.get(k) for k in CACHED_FIELDS if k in verified_data}
+        record["verified"] = verified
+        # Also index the resolved record so later lookups by its DOI/title hit
+        keys = set(self.keys_for(item))
+        if verified:
+            keys.update(self.keys_for(verified_data))
+        expires_at = time.time() + (self.positive_ttl if verified else self.negative_ttl)
+        return [(k, json.dumps(record), int(verified), mode, expires_at) for k in keys]
+
+    def put(self, item: Dict[str, Any], verified_data: Dict[str, Any], mode: str = "standard"):
+        self.put_many([(item, verified_data)], mode)
+
+    def put_many(self, entries: List[Tuple[Dict[str, Any], Dict[str, Any]]], mode: str = "standard"):
+        """Writes several (item, verified_data) results in one transaction."""
+        rows = [row for item, verified_data in entries for row in self._rows(item, verified_data, mode)]
+        if not rows:
+            return
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO verification (key, record, verified, mode, expires_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        rows
+                    )
+                if time.time() - self._last_purge > self.purge_interval:
+                    self._purge(conn)
+        except Exception as e:
+            print(f"KARION Cache write error: {e}")
+
+    async def aget(self, item: Dict[str, Any], mode: str = "standard") -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get, item, mode)
+
+    async def aget_many(self, items: List[Dict[str, Any]], mode: str = "standard") -> List[Optional[Dict[str, Any]]]:
+        return await asyncio.to_thread(lambda: [self.get(item, mode) for item in items])
+
+    async def aput(self, item: Dict[str, Any], verified_data: Dict[str, Any], mode: str = "standard"):
+        await asyncio.to_thread(self.put, item, verified_data, mode)
+
+    async def aput_many(self, entries: List[Tuple[Dict[str, Any], Dict[str, Any]]], mode: str = "standard"):
+        if entries:
+            await asyncio.to_thread(self.put_many, entries, mode)
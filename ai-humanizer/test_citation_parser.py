@@ -0,0 +1,32 @@
+from services.citation_parser import parse_references, split_entries
+
+UNNUMBERED_IEEE = (
+    'A. Vaswani, N. Shazeer, and N. Parmar, "Attention is all you need," in Proc. NeurIPS, 2017, pp. 5998-6008.\n'
+    'K. He, X. Zhang, S. Ren, and J. Sun, "Deep residual learning for image recognition," in Proc. CVPR, 2016.\n'
+    'J. Devlin, M. Chang, K. Lee, and K. Toutanova, "BERT: Pre-training of deep bidirectional transformers for\n'
+    'language understanding," in Proc. NAACL, 2019, pp. 4171-4186.'
+)
+
+
+def test_unnumbered_lines_are_separate_entries():
+    parsed = parse_references(UNNUMBERED_IEEE)
+    assert len(parsed) == 3
+    assert parsed[2][1]["title"].endswith("language understanding")
+
+
+def test_wrapped_single_entry_stays_whole():
+    text = "Smith, J. (2020). Title of the thing here.\nJournal of Stuff, 3(2), 1-10."
+    assert len(split_entries(text)) == 1
+
+
+def test_merged_entries_score_low():
+    merged = 'A. B, "One title here," J. Foo, 2017. C. D, "Two title here," J. Bar, 2018.'
+    (_, _, score), = parse_references(merged)
+    assert score < 0.7
+
+
+if __name__ == "__main__":
+    test_unnumbered_lines_are_separate_entries()
+    test_wrapped_single_entry_stays_whole()
+    test_merged_entries_score_low()
+    print("✅ citation_parser tests passed")